@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import calendar
+import os
+import re
+
+from array import array
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from django.utils import timezone
+
+from .models import MinuteData
+from .profiles import MINUTES_PER_DAY, SAMPLES_DTYPE, WATTS_DTYPE
+from .utils import get_rollup_timezone, local_day_range
+
+
+MINUTES_DTYPE = np.dtype('<i4')
+ARCHIVE_WATTS_DTYPE = np.dtype('<f4')
+ARCHIVE_RE = re.compile(r'^minutes-(\d{4})-(\d{2})\.minutes\.i4$')
+
+
+def epoch_minute(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) // 60
+
+
+def month_dates(year, month):
+    return [date(year, month, day)
+            for day in range(1, calendar.monthrange(year, month)[1] + 1)]
+
+
+class MinuteArchive(object):
+    """
+    A directory of closed months of MinuteData, stored column by column as
+    fixed-width little-endian files:
+
+        minutes-YYYY-MM.minutes.i4   minutes since the epoch (int32)
+        minutes-YYYY-MM.watts.f4     the minute's average watts (float32)
+
+    The reader memory-maps the files, so slicing out any time range returns
+    views onto the page cache rather than a Python object per row.
+    """
+    def __init__(self, directory, tz=None):
+        self.directory = directory
+        self.tz = tz or get_rollup_timezone()
+
+    def file_names(self, year, month):
+        prefix = os.path.join(
+            self.directory, 'minutes-{0:04d}-{1:02d}'.format(year, month))
+        return prefix + '.minutes.i4', prefix + '.watts.f4'
+
+    def months(self):
+        """
+        Returns the sorted list of archived (year, month).
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        months = []
+        for name in os.listdir(self.directory):
+            match = ARCHIVE_RE.match(name)
+            if match:
+                months.append((int(match.group(1)), int(match.group(2))))
+        return sorted(months)
+
+    def month_range(self, year, month):
+        first = month_dates(year, month)[0]
+        last = month_dates(year, month)[-1]
+        return local_day_range(first, self.tz)[0], \
+            local_day_range(last, self.tz)[1]
+
+    def export(self, year, month):
+        """
+        Writes the MinuteData of the closed local month to its files. Returns
+        the number of minutes written.
+        """
+        start, end = self.month_range(year, month)
+        if end > timezone.now():
+            raise ValueError('{0}-{1:02d} has not closed yet'.format(
+                year, month))
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        minutes = array(str('i'))
+        watts = array(str('f'))
+        rows = MinuteData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).order_by('timestamp').values_list('timestamp', 'watts')
+        for timestamp, value in rows.iterator():
+            minutes.append(epoch_minute(timestamp))
+            watts.append(float(value))
+
+        columns = zip(self.file_names(year, month), (
+            np.frombuffer(minutes, dtype=np.intc).astype(MINUTES_DTYPE),
+            np.frombuffer(watts, dtype=np.float32).astype(
+                ARCHIVE_WATTS_DTYPE)))
+        for file_name, column in columns:
+            column.tofile(file_name + '.tmp')
+            os.rename(file_name + '.tmp', file_name)
+        return len(minutes)
+
+    def load(self, year, month):
+        """
+        Returns the memory-mapped (minutes, watts) columns of a month.
+        """
+        minutes_name, watts_name = self.file_names(year, month)
+        if not os.path.getsize(minutes_name):
+            return (np.zeros(0, dtype=MINUTES_DTYPE),
+                    np.zeros(0, dtype=ARCHIVE_WATTS_DTYPE))
+        return (np.memmap(minutes_name, dtype=MINUTES_DTYPE, mode='r'),
+                np.memmap(watts_name, dtype=ARCHIVE_WATTS_DTYPE, mode='r'))
+
+    def range(self, start, end):
+        """
+        Returns a list of (minutes, watts) views, one per archived month,
+        covering the aware range [start, end). No data is copied.
+        """
+        first, last = epoch_minute(start), epoch_minute(end)
+        segments = []
+        for year, month in self.months():
+            month_start, month_end = self.month_range(year, month)
+            if month_end <= start or month_start >= end:
+                continue
+            minutes, watts = self.load(year, month)
+            lo, hi = np.searchsorted(minutes, [first, last])
+            if hi > lo:
+                segments.append((minutes[lo:hi], watts[lo:hi]))
+        return segments
+
+    def range_arrays(self, start, end):
+        """
+        Like range(), but joins the months into a single pair of arrays
+        (which copies them if the range spans more than one month).
+        """
+        segments = self.range(start, end)
+        if len(segments) == 1:
+            return segments[0]
+        if not segments:
+            return (np.zeros(0, dtype=MINUTES_DTYPE),
+                    np.zeros(0, dtype=ARCHIVE_WATTS_DTYPE))
+        return (np.concatenate([segment[0] for segment in segments]),
+                np.concatenate([segment[1] for segment in segments]))
+
+    def day_bounds(self, year, month):
+        """
+        Returns the epoch minute at which each local day of the month starts,
+        plus the one at which the month ends.
+        """
+        dates = month_dates(year, month)
+        bounds = [epoch_minute(local_day_range(day, self.tz)[0])
+                  for day in dates]
+        bounds.append(epoch_minute(local_day_range(dates[-1], self.tz)[1]))
+        return np.array(bounds, dtype=np.int64)
+
+    def daily_energy(self, year, month):
+        """
+        Returns a dict of {date: kWHrs} for an archived month, the same
+        figures get_daily_data() shows.
+        """
+        minutes, watts = self.load(year, month)
+        bounds = self.day_bounds(year, month)
+        edges = np.searchsorted(minutes, bounds)
+        totals = np.concatenate(
+            ([0.0], np.cumsum(watts, dtype=np.float64)))
+        energy = (totals[edges[1:]] - totals[edges[:-1]]) / 60000
+        return dict(zip(month_dates(year, month), energy.tolist()))
+
+    def day_profiles(self, year, month):
+        """
+        Returns a dict of {date: (watts, samples)} profiles for an archived
+        month, suitable for profiles.hourly_watt_minutes().
+        """
+        minutes, watts = self.load(year, month)
+        bounds = self.day_bounds(year, month)
+        edges = np.searchsorted(minutes, bounds)
+        result = dict()
+        for index, day in enumerate(month_dates(year, month)):
+            lo, hi = edges[index], edges[index + 1]
+            day_start = bounds[index]
+            start, end = local_day_range(day, self.tz)
+            if start.utcoffset() == (end - timedelta(minutes=1)).utcoffset():
+                slots = minutes[lo:hi] - day_start
+            else:
+                # DST changes today, work the local minute out one by one.
+                slots = np.array([
+                    self.local_minute(minute) for minute in minutes[lo:hi]],
+                    dtype=np.int64)
+            totals = np.bincount(slots, weights=watts[lo:hi],
+                                 minlength=MINUTES_PER_DAY)
+            samples = np.bincount(slots, minlength=MINUTES_PER_DAY)
+            day_watts = np.zeros(MINUTES_PER_DAY, dtype=WATTS_DTYPE)
+            recorded = samples > 0
+            day_watts[recorded] = totals[recorded] / samples[recorded]
+            result[day] = (day_watts, samples.astype(SAMPLES_DTYPE))
+        return result
+
+    def local_minute(self, minute):
+        local = timezone.make_aware(
+            datetime.utcfromtimestamp(int(minute) * 60),
+            timezone.utc).astimezone(self.tz)
+        return local.hour * 60 + local.minute
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import glob
+import gzip
+import json
+import os
+
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+from django.db import connection
+from django.utils import timezone
+
+from .ingest import BufferedWriter
+from .parsing import FastLineParser
+
+
+def expand_paths(patterns):
+    """
+    Expands a list of file names and/or glob patterns into a sorted list of
+    unique, absolute paths.
+    """
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(os.path.expanduser(pattern))
+        paths.update(os.path.abspath(path) for path in matches
+                     if os.path.isfile(path))
+    return sorted(paths)
+
+
+def open_log(path):
+    """
+    Opens an Efergy log for reading, transparently un-gzipping rotated logs.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'r')
+
+
+class Checkpoints(object):
+    """
+    Per-file backfill progress, persisted as JSON in «file_name». For each
+    log we remember how many lines have been committed, the size of the file
+    at the time and whether it has been completely loaded.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        try:
+            with open(file_name) as checkpoint_file:
+                self.data = json.load(checkpoint_file)
+        except (IOError, ValueError):
+            self.data = dict()
+
+    def get(self, path):
+        """
+        Returns (lines, done) for «path». Progress is discarded if the file
+        has shrunk since, which means it was rotated or replaced.
+        """
+        entry = self.data.get(path)
+        if not entry or os.path.getsize(path) < entry['size']:
+            return 0, False
+        if entry['done'] and os.path.getsize(path) != entry['size']:
+            # Appended to since we finished it, pick up the new lines.
+            return entry['lines'], False
+        return entry['lines'], entry['done']
+
+    def set(self, path, lines, done=False):
+        self.data[path] = {
+            'lines': lines,
+            'size': os.path.getsize(path),
+            'done': done,
+        }
+
+    def save(self):
+        """
+        Writes the checkpoints atomically, so an interrupted run can never
+        leave a truncated checkpoint file behind.
+        """
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w') as checkpoint_file:
+            json.dump(self.data, checkpoint_file, indent=2, sort_keys=True)
+        os.rename(temp_name, self.file_name)
+
+
+def iter_chunks(paths, checkpoints, chunk_size):
+    """
+    Yields (path, line_number, lines, is_last) for every chunk of
+    «chunk_size» lines not yet committed according to «checkpoints».
+    «line_number» is the number of lines of «path» consumed after the chunk.
+    """
+    for path in paths:
+        skip, done = checkpoints.get(path)
+        if done:
+            continue
+        line_number = 0
+        chunk = []
+        with open_log(path) as log_file:
+            for line in log_file:
+                line_number += 1
+                if line_number <= skip:
+                    continue
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    yield path, line_number, chunk, False
+                    chunk = []
+        yield path, max(line_number, skip), chunk, True
+
+
+_parser = None
+
+
+def _init_worker(tz):
+    global _parser
+    _parser = FastLineParser(tz)
+
+
+def _parse_chunk(task):
+    path, line_number, lines, is_last = task
+    entries, failures = _parser.parse_chunk(lines)
+    return path, line_number, entries, len(failures), is_last
+
+
+class Backfill(object):
+    """
+    Loads many (optionally gzipped) Efergy logs. Chunks of lines are parsed
+    across a pool of processes, while the parent bulk-loads the results in
+    order and checkpoints each file after every committed chunk.
+    """
+    def __init__(self, paths, checkpoints, workers=None, chunk_size=20000,
+                 batch_size=1000, dedup=None):
+        self.paths = paths
+        self.checkpoints = checkpoints
+        self.workers = workers or cpu_count()
+        self.chunk_size = chunk_size
+        self.writer = BufferedWriter(batch_size=batch_size, dedup=dedup)
+
+    def commit(self, result):
+        """
+        Writes out a parsed chunk, then checkpoints it. If it can't be written
+        flush() raises, which stops the run before the checkpoint moves.
+        """
+        path, line_number, entries, failures, is_last = result
+        self.writer.stats.rejected += failures
+        self.writer.extend(entries)
+        self.writer.flush()
+        self.checkpoints.set(path, line_number, done=is_last)
+        self.checkpoints.save()
+        if is_last:
+            print('Finished {0}: {1}'.format(path, self.writer.stats.report()))
+
+    def run(self):
+        # Children mustn't inherit (and later close) our DB connection.
+        connection.close()
+        pool = Pool(self.workers, _init_worker,
+                    (timezone.get_current_timezone(), ))
+        # Keep a bounded number of chunks in flight so that memory stays flat
+        # however large the archive is.
+        max_pending = self.workers * 2
+        pending = deque()
+        try:
+            for task in iter_chunks(self.paths, self.checkpoints,
+                                    self.chunk_size):
+                pending.append(pool.apply_async(_parse_chunk, (task, )))
+                if len(pending) >= max_pending:
+                    self.commit(pending.popleft().get())
+            while pending:
+                self.commit(pending.popleft().get())
+        finally:
+            pool.terminate()
+            pool.join()
+        return self.writer.stats
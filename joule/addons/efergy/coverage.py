@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+An hourly index of how much data is stored: one CoverageBucket per kind of
+data and UTC hour, counting its rows. The writers add to it as they insert,
+so reporting coverage over the last month reads at most 720 small rows
+instead of counting up to a month of the tables themselves.
+"""
+
+from __future__ import unicode_literals, division
+
+import pytz
+
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .db import bulk_upsert
+from .models import CoverageBucket, EfergyData, MinuteData
+
+
+RAW = CoverageBucket.RAW
+MINUTE = CoverageBucket.MINUTE
+
+MODELS = {RAW: EfergyData, MINUTE: MinuteData}
+
+# The number of rows of each kind in a fully covered hour.
+EXPECTED_PER_HOUR = {RAW: 360, MINUTE: 60}
+
+# The (hour, day, week, month) spans get_coverage() reports, in hours.
+SPANS = (1, 24, 7 * 24, 30 * 24)
+
+HOUR = timedelta(hours=1)
+
+
+def hour_start(timestamp):
+    return timestamp.astimezone(pytz.utc).replace(
+        minute=0, second=0, microsecond=0)
+
+
+def record(kind, timestamps):
+    """
+    Adds the rows of «kind» just inserted at «timestamps» to the index.
+    """
+    counts = Counter(hour_start(timestamp) for timestamp in timestamps)
+    return bulk_upsert(
+        CoverageBucket, ('kind', 'hour', 'count'),
+        [(kind, hour, count) for hour, count in sorted(counts.items())],
+        increment_fields=('count', ), conflict_fields=('kind', 'hour'))
+
+
+def refresh(kind, start, end, window=timedelta(days=1)):
+    """
+    Recounts every hour touched by [start, end) from the table of «kind»,
+    one «window» at a time. Returns the number of rows counted.
+    """
+    start = hour_start(start)
+    end = hour_start(end - timedelta(microseconds=1)) + HOUR
+    counted = 0
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window, end)
+        timestamps = MODELS[kind].objects.filter(
+            timestamp__gte=window_start, timestamp__lt=window_end,
+        ).values_list('timestamp', flat=True)
+        counts = Counter(
+            hour_start(timestamp) for timestamp in timestamps.iterator())
+        with transaction.atomic():
+            CoverageBucket.objects.filter(
+                kind=kind, hour__gte=window_start, hour__lt=window_end,
+            ).delete()
+            CoverageBucket.objects.bulk_create([
+                CoverageBucket(kind=kind, hour=hour, count=count)
+                for hour, count in sorted(counts.items())])
+        counted += sum(counts.values())
+        window_start = window_end
+    return counted
+
+
+def rebuild(kind):
+    """
+    Recounts the whole table of «kind». Returns the number of rows counted.
+    """
+    model = MODELS[kind]
+    first = model.objects.order_by('timestamp').values_list(
+        'timestamp', flat=True).first()
+    if first is None:
+        CoverageBucket.objects.filter(kind=kind).delete()
+        return 0
+    last = model.objects.order_by('-timestamp').values_list(
+        'timestamp', flat=True).first()
+    CoverageBucket.objects.filter(kind=kind).exclude(
+        hour__gte=hour_start(first), hour__lte=hour_start(last)).delete()
+    return refresh(kind, first, last + timedelta(microseconds=1))
+
+
+def get_counts(kind, start, end):
+    """
+    Returns a dict of {hour: count} for the hours of [start, end) that have
+    any rows of «kind».
+    """
+    return dict(CoverageBucket.objects.filter(
+        kind=kind, hour__gte=start, hour__lt=end,
+    ).values_list('hour', 'count'))
+
+
+def get_coverage(kind, now=None):
+    """
+    Returns the (hour, day, week, month) percentages of the expected rows of
+    «kind» that are stored, over the last complete hour, 24 hours, 7 days and
+    30 days.
+    """
+    end = hour_start(now or timezone.now())
+    counts = get_counts(kind, end - max(SPANS) * HOUR, end)
+    percentages = []
+    for span in SPANS:
+        since = end - span * HOUR
+        total = sum(count for hour, count in counts.items() if hour >= since)
+        percentages.append(
+            float(total) / (span * EXPECTED_PER_HOUR[kind]) * 100)
+    return tuple(percentages)
+
+
+def get_gaps(kind, start, end, min_count=1):
+    """
+    Returns the list of [gap_start, gap_end) ranges within [start, end),
+    whole hours, during which fewer than «min_count» rows of «kind» were
+    stored per hour.
+    """
+    start = hour_start(start)
+    counts = get_counts(kind, start, end)
+    gaps = []
+    hour = start
+    while hour < end:
+        if counts.get(hour, 0) < min_count:
+            if gaps and gaps[-1][1] == hour:
+                gaps[-1] = (gaps[-1][0], hour + HOUR)
+            else:
+                gaps.append((hour, hour + HOUR))
+        hour += HOUR
+    return gaps
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import connection
+
+
+# SQLite refuses statements with more than 999 parameters.
+SQLITE_MAX_VARIABLES = 999
+
+
+def bulk_upsert(model, fields, rows, update_fields=(), conflict_fields=(),
+                batch_size=1000, increment_fields=()):
+    """
+    Inserts «rows» (sequences of values in the order of «fields») into the
+    table of «model» with multi-row INSERT statements.
+
+    Rows that collide with a unique constraint either leave the stored row
+    alone or, if «update_fields» are given, overwrite those columns of it.
+    The columns of «increment_fields» are added to the stored ones instead.
+    PostgreSQL and SQLite need the column(s) of that unique constraint as
+    «conflict_fields» to update.
+
+    Returns the number of rows inserted when stored rows are left alone,
+    otherwise the number of rows the database reports as affected.
+    """
+    if not rows:
+        return 0
+
+    opts = model._meta
+    field_objects = [opts.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    table = quote(opts.db_table)
+    columns = ", ".join(quote(field.column) for field in field_objects)
+    placeholder = "({0})".format(", ".join(["%s"] * len(fields)))
+    update_columns = [quote(opts.get_field(name).column)
+                      for name in update_fields]
+    increment_columns = [quote(opts.get_field(name).column)
+                         for name in increment_fields]
+    conflict_columns = ", ".join(quote(opts.get_field(name).column)
+                                 for name in conflict_fields)
+
+    vendor = connection.vendor
+    if vendor == 'mysql':
+        statement = "INSERT INTO {table} ({columns}) VALUES {values}"
+        if update_columns or increment_columns:
+            statement += " ON DUPLICATE KEY UPDATE " + ", ".join(
+                ["{0}=VALUES({0})".format(column)
+                 for column in update_columns] +
+                ["{0}={0}+VALUES({0})".format(column)
+                 for column in increment_columns])
+        else:
+            # Not ON DUPLICATE KEY UPDATE pk=pk: Django connects with
+            # CLIENT.FOUND_ROWS, which counts every duplicate as affected.
+            statement = statement.replace("INSERT", "INSERT IGNORE", 1)
+    elif vendor in ('postgresql', 'sqlite'):
+        if vendor == 'sqlite':
+            batch_size = min(batch_size, SQLITE_MAX_VARIABLES // len(fields))
+        statement = "INSERT INTO {table} ({columns}) VALUES {values}"
+        if update_columns or increment_columns:
+            statement += " ON CONFLICT ({0}) DO UPDATE SET ".format(
+                conflict_columns) + ", ".join(
+                ["{0}=excluded.{0}".format(column)
+                 for column in update_columns] +
+                ["{0}={1}.{0}+excluded.{0}".format(column, table)
+                 for column in increment_columns])
+        elif vendor == 'sqlite':
+            statement = statement.replace("INSERT", "INSERT OR IGNORE", 1)
+        else:
+            statement += " ON CONFLICT DO NOTHING"
+    else:
+        raise NotImplementedError(
+            "bulk_upsert() does not support {0}".format(vendor))
+
+    affected = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = []
+            for row in batch:
+                params.extend(
+                    field.get_db_prep_save(value, connection)
+                    for field, value in zip(field_objects, row))
+            cursor.execute(statement.format(
+                table=table, columns=columns,
+                values=", ".join([placeholder] * len(batch))), params)
+            affected += max(cursor.rowcount, 0)
+    return affected
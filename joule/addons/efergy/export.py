@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Streams raw or minute data as CSV or NDJSON, optionally gzipped. The rows
+are read in time windows with .iterator(), and encoded and compressed as
+they arrive, so memory use is constant and output starts with the first
+window however long the range is.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import pytz
+import zlib
+
+from datetime import timedelta
+
+from .coverage import MINUTE, MODELS, RAW
+
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+
+CONTENT_TYPES = {CSV: 'text/csv', NDJSON: 'application/x-ndjson'}
+
+FIELDS = {
+    RAW: ('timestamp', 'watts'),
+    MINUTE: ('timestamp', 'minute', 'watts'),
+}
+
+
+def iter_rows(kind, start, end, window=timedelta(hours=6)):
+    """
+    Yields the FIELDS[«kind»] tuples of every row of «kind» in [start, end),
+    in time order, one «window» at a time.
+    """
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window, end)
+        rows = MODELS[kind].objects.filter(
+            timestamp__gte=window_start, timestamp__lt=window_end,
+        ).order_by('timestamp').values_list(*FIELDS[kind])
+        for row in rows.iterator():
+            yield row
+        window_start = window_end
+
+
+def format_value(value):
+    if hasattr(value, 'astimezone'):
+        return value.astimezone(pytz.utc).isoformat()
+    return '{0}'.format(value)
+
+
+def iter_csv(kind, rows):
+    yield ','.join(FIELDS[kind]) + '\n'
+    for row in rows:
+        yield ','.join(format_value(value) for value in row) + '\n'
+
+
+def json_value(field, value):
+    if field == 'watts':
+        return float(value)
+    if field == 'minute':
+        return value
+    return format_value(value)
+
+
+def iter_ndjson(kind, rows):
+    for row in rows:
+        yield json.dumps(dict(
+            (field, json_value(field, value))
+            for field, value in zip(FIELDS[kind], row)),
+            sort_keys=True) + '\n'
+
+
+def iter_gzip(chunks, level=6):
+    """
+    Compresses a stream of byte strings into a gzip stream, chunk by chunk.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_chunks(lines, chunk_size):
+    """
+    Joins «lines» into chunks of at least «chunk_size» bytes, so that a
+    response isn't written one short line at a time.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def iter_export(kind, start, end, format=CSV, compress=False,
+                chunk_size=65536):
+    """
+    Yields the rows of «kind» in [start, end), encoded in «format» and, if
+    «compress», gzipped, as byte strings of about «chunk_size» bytes.
+    """
+    encode = {CSV: iter_csv, NDJSON: iter_ndjson}[format]
+    chunks = iter_chunks(
+        (line.encode('utf-8')
+         for line in encode(kind, iter_rows(kind, start, end))),
+        chunk_size)
+    if compress:
+        chunks = iter_gzip(chunks)
+    return chunks
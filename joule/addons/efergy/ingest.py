@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import heapq
+import os
+import time
+
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.utils import (
+    DatabaseError, IntegrityError, InterfaceError, OperationalError)
+
+from . import coverage
+from .models import EfergyData
+from .rollup import MinuteRollup
+
+
+# The errors that mean the database can't be reached (or is locked), as
+# opposed to refusing a particular row.
+OUTAGE_ERRORS = (OperationalError, InterfaceError)
+
+
+class WriterStats(object):
+    """
+    Running counters for a BufferedWriter.
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.started = clock()
+        self._last_report = self.started
+        self._last_inserted = 0
+
+    @property
+    def elapsed(self):
+        return max(self.clock() - self.started, 1e-9)
+
+    @property
+    def rate(self):
+        """Average rows/sec since the writer was created."""
+        return self.inserted / self.elapsed
+
+    def interval_rate(self):
+        """
+        Returns the rows/sec sustained since the previous call (or since the
+        writer was created) and resets the interval.
+        """
+        now = self.clock()
+        interval = max(now - self._last_report, 1e-9)
+        rate = (self.inserted - self._last_inserted) / interval
+        self._last_report = now
+        self._last_inserted = self.inserted
+        return rate
+
+    def report(self):
+        return (
+            "Inserted {inserted} rows in {batches} batches "
+            "({interval:.1f} rows/sec now, {rate:.1f} rows/sec overall); "
+            "{duplicates} duplicates, {rejected} rejected".format(
+                inserted=self.inserted,
+                batches=self.batches,
+                interval=self.interval_rate(),
+                rate=self.rate,
+                duplicates=self.duplicates,
+                rejected=self.rejected,
+            ))
+
+
+class DedupWindow(object):
+    """
+    A bounded, time-ordered set of the most recently seen (timestamp, watts)
+    pairs, used to drop duplicate samples before they cost a failed INSERT.
+
+    Pairs older than «span» before the newest timestamp seen, and the oldest
+    pairs beyond «max_size», are forgotten. A sample older than the window is
+    simply not known, so it is left to the database to decide.
+    """
+    precision = Decimal('0.000001')
+
+    def __init__(self, max_size=20000, span=timedelta(hours=24)):
+        self.max_size = max_size
+        self.span = span
+        self.hits = 0
+        self.misses = 0
+        self._keys = set()
+        self._heap = []
+        self._newest = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def key(self, entry):
+        # The watts column rounds to 6 decimal places, so must we.
+        return entry['timestamp'], entry['watts'].quantize(self.precision)
+
+    def add(self, key):
+        if key in self._keys:
+            return
+        heapq.heappush(self._heap, key)
+        self._keys.add(key)
+        if self._newest is None or key[0] > self._newest:
+            self._newest = key[0]
+        while self._heap and (len(self._keys) > self.max_size or
+                              self._heap[0][0] < self._newest - self.span):
+            self._keys.discard(heapq.heappop(self._heap))
+
+    def seen(self, entry):
+        """
+        Returns True if «entry» is a known duplicate, otherwise remembers it
+        and returns False.
+        """
+        key = self.key(entry)
+        if key in self._keys:
+            self.hits += 1
+            return True
+        self.misses += 1
+        self.add(key)
+        return False
+
+    def seed(self):
+        """
+        Pre-loads the window with the most recently stored samples.
+        """
+        latest = EfergyData.objects.order_by('-timestamp').first()
+        if latest is None:
+            return 0
+        rows = EfergyData.objects.filter(
+            timestamp__gte=latest.timestamp - self.span
+        ).order_by('-timestamp').values_list('timestamp', 'watts')
+        for timestamp, watts in rows[:self.max_size]:
+            self.add((timestamp, watts.quantize(self.precision)))
+        return len(self)
+
+    def report(self):
+        return "dedup window: {0} entries, {1} hits, {2} misses".format(
+            len(self), self.hits, self.misses)
+
+
+class BufferedWriter(object):
+    """
+    Collects parsed EfergyData entries (dicts of «timestamp» and «watts») and
+    writes them with a single ``bulk_create`` per batch rather than an INSERT
+    per entry.
+
+    A batch is flushed as soon as it holds «batch_size» entries, or when
+    poll() notices that the oldest buffered entry has waited «max_latency»
+    seconds, so a slow trickle of live samples still lands promptly.
+
+    Duplicates are still detected by the unique constraint on EfergyData. When
+    a batch fails with an IntegrityError, the rows that already exist are
+    weeded out and the remainder is retried, falling back to row-by-row
+    inserts only if the table changed underneath us in the meantime. When a
+    batch fails with any other error but an outage (see OUTAGE_ERRORS), it is
+    written row by row, and the rows the database refuses are quarantined:
+    counted as rejected and, with a spool, set aside in its quarantine file.
+
+    With a «spool», every accepted entry is first appended to the spool, and
+    each batch's segment is only acknowledged once the batch is committed. If
+    the database is unavailable, the segment is kept and replayed from disk
+    on a later flush (or on the next start, see replay()). Without a spool
+    there is nowhere safe to keep the batch, so the error is raised and the
+    batch stays buffered.
+
+    With a «dedup» DedupWindow, samples already seen recently are dropped
+    (and counted as duplicates) without involving the database at all.
+
+    The inserted samples are added to the raw coverage index, and the minute
+    rollup is rewound to the earliest of them.
+    """
+    def __init__(self, batch_size=500, max_latency=5.0, clock=time.time,
+                 spool=None, dedup=None):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.clock = clock
+        self.spool = spool
+        self.dedup = dedup
+        self.stats = WriterStats(clock)
+        self._buffer = []
+        self._oldest = None
+        self._unacked = []
+        self._watts_field = EfergyData._meta.get_field('watts')
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def is_valid(self, entry):
+        """
+        Returns False if «entry» would be refused by the watts column, which
+        is what used to surface as an InvalidOperation on create().
+        """
+        try:
+            self._watts_field.get_db_prep_save(entry['watts'], connection)
+        except InvalidOperation:
+            return False
+        return True
+
+    def add(self, entry):
+        """
+        Buffers «entry», flushing if the batch is full. Returns False if the
+        entry was rejected as bogus or dropped as a known duplicate.
+        """
+        if not self.is_valid(entry):
+            self.stats.rejected += 1
+            print('Skipping bogus data {watts} @ {timestamp}'.format(**entry))
+            return False
+        if self.dedup is not None and self.dedup.seen(entry):
+            self.stats.duplicates += 1
+            return False
+        if self.spool is not None:
+            self.spool.append(entry)
+        if self._oldest is None:
+            self._oldest = self.clock()
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        return True
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def poll(self):
+        """
+        Flushes the buffer if its oldest entry has been waiting too long.
+        """
+        if (self._oldest is not None and
+                self.clock() - self._oldest >= self.max_latency):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes out everything that is buffered. Returns the list of entries
+        that were actually inserted. Raises one of OUTAGE_ERRORS if the batch
+        could neither be written nor spooled.
+        """
+        batch, self._buffer, self._oldest = self._buffer, [], None
+        segment = self.spool.seal() if self.spool is not None else None
+        if self._unacked and not self._replay_unacked():
+            # Still no database, leave this batch on disk too.
+            if segment is not None:
+                self._unacked.append(segment)
+            return []
+        if not batch:
+            return []
+        try:
+            inserted = self._commit(batch)
+        except OUTAGE_ERRORS as error:
+            self._failed(error, batch, segment)
+            if segment is None:
+                self._buffer[:0] = batch
+                self._oldest = self.clock()
+                raise
+            return []
+        if segment is not None:
+            self.spool.ack(segment)
+        return inserted
+
+    def _commit(self, batch):
+        inserted = self._write(self._unique(batch))
+        if inserted:
+            timestamps = [entry['timestamp'] for entry in inserted]
+            coverage.record(coverage.RAW, timestamps)
+            MinuteRollup.rewind(min(timestamps))
+        self.stats.inserted += len(inserted)
+        self.stats.batches += 1
+        return inserted
+
+    def _failed(self, error, batch, segment):
+        self.stats.failed_batches += 1
+        # Make sure we reconnect next time around.
+        connection.close()
+        if segment is not None:
+            self._unacked.append(segment)
+            print('Unable to write {0} entries, kept in {1}: {2}'.format(
+                len(batch), segment, error))
+        else:
+            print('Unable to write {0} entries: {1}'.format(
+                len(batch), error))
+
+    def _replay_unacked(self):
+        try:
+            count, seconds = self.replay(self._unacked)
+        except OUTAGE_ERRORS as error:
+            self.stats.failed_batches += 1
+            connection.close()
+            print('Database still unavailable: {0}'.format(error))
+            return False
+        self._unacked = []
+        print('Replayed {0} spooled samples in {1:.2f}s ({2:.1f} rows/sec)'
+              .format(count, seconds, count / max(seconds, 1e-9)))
+        return True
+
+    def replay(self, segments=None):
+        """
+        Commits the entries of the given spool «segments» (by default, every
+        segment left over from a previous run) in batches, acknowledging each
+        segment once it is committed. Returns (entries, seconds).
+        """
+        if segments is None:
+            segments = self.spool.pending()
+        started = self.clock()
+        count = 0
+        for segment in segments:
+            if not os.path.exists(segment):
+                # Acknowledged by an earlier, partially successful replay.
+                continue
+            batch = []
+            for entry in self.spool.read(segment):
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    self._commit(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._commit(batch)
+                count += len(batch)
+            self.spool.ack(segment)
+        return count, self.clock() - started
+
+    def recover(self):
+        """
+        Replays the segments left behind by a previous run. If the database
+        is unavailable they are kept for a later flush. Returns (entries,
+        seconds), or None if nothing could be replayed yet.
+        """
+        segments = self.spool.pending()
+        if not segments:
+            return 0, 0.0
+        try:
+            return self.replay(segments)
+        except OUTAGE_ERRORS as error:
+            connection.close()
+            self._unacked = segments
+            print('Unable to replay {0} spool segments yet: {1}'.format(
+                len(segments), error))
+            return None
+
+    def _unique(self, batch):
+        """
+        Drops entries repeated within the batch itself.
+        """
+        seen = set()
+        unique = []
+        for entry in batch:
+            key = (entry['timestamp'], entry['watts'])
+            if key in seen:
+                self.stats.duplicates += 1
+                continue
+            seen.add(key)
+            unique.append(entry)
+        return unique
+
+    def _bulk_create(self, entries):
+        with transaction.atomic():
+            EfergyData.objects.bulk_create(
+                [EfergyData(**entry) for entry in entries])
+
+    def _write(self, batch):
+        try:
+            self._bulk_create(batch)
+            return batch
+        except IntegrityError:
+            pass
+        except OUTAGE_ERRORS:
+            raise
+        except DatabaseError:
+            # Some row is refused for another reason, find out which.
+            return self._write_rows(batch)
+
+        # Part of the batch is already stored, find out which part.
+        timestamps = [entry['timestamp'] for entry in batch]
+        existing = set(EfergyData.objects.filter(
+            timestamp__range=(min(timestamps), max(timestamps))
+        ).values_list('timestamp', 'watts'))
+        fresh = []
+        for entry in batch:
+            if (entry['timestamp'], entry['watts']) in existing:
+                self.stats.duplicates += 1
+            else:
+                fresh.append(entry)
+
+        if not fresh:
+            return []
+        try:
+            self._bulk_create(fresh)
+            return fresh
+        except OUTAGE_ERRORS:
+            raise
+        except DatabaseError:
+            pass
+
+        # Someone else is writing the same samples, or some row is refused.
+        return self._write_rows(fresh)
+
+    def _write_rows(self, entries):
+        """
+        Inserts «entries» one at a time, skipping duplicates and quarantining
+        the rows the database refuses. Returns the list of inserted entries.
+        """
+        inserted = []
+        for entry in entries:
+            try:
+                self._bulk_create([entry])
+                inserted.append(entry)
+            except IntegrityError:
+                self.stats.duplicates += 1
+            except OUTAGE_ERRORS:
+                raise
+            except DatabaseError as error:
+                self._quarantine(entry, error)
+        return inserted
+
+    def _quarantine(self, entry, error):
+        self.stats.rejected += 1
+        if self.spool is not None:
+            self.spool.quarantine(entry)
+        print('Quarantined {watts} @ {timestamp}: {error}'.format(
+            error=error, **entry))
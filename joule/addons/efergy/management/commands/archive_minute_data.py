@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import kronos
+
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from joule.utils import Timer
+
+from ...archive import MinuteArchive
+from ...models import MinuteData
+
+
+def parse_month(month_string):
+    month = datetime.strptime(month_string, '%Y-%m')
+    return month.year, month.month
+
+
+@kronos.register("0 4 1 * *")
+class Command(BaseCommand):
+
+    help = """Writes closed months of minute data to the memory-mappable
+    columnar archive in EFERGY_COLUMNAR_DIR. Without --month, every closed
+    month that isn't archived yet is written.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month', type=parse_month, action='append', default=[],
+            metavar='YYYY-MM', help='(Re-)archive this month.')
+        parser.add_argument(
+            '--directory', type=str,
+            default=getattr(settings, 'EFERGY_COLUMNAR_DIR', 'efergy_columns'))
+
+    def get_closed_months(self, archive):
+        first = MinuteData.objects.order_by('timestamp').first()
+        if first is None:
+            return []
+        year, month = first.timestamp.astimezone(archive.tz).timetuple()[:2]
+        now = timezone.now().astimezone(archive.tz)
+        months = []
+        while (year, month) < (now.year, now.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        archived = set(archive.months())
+        return [month for month in months if month not in archived]
+
+    def handle(self, *args, **options):
+        archive = MinuteArchive(options['directory'])
+        months = options['month'] or self.get_closed_months(archive)
+        for year, month in months:
+            with Timer() as timer:
+                count = archive.export(year, month)
+            print("{0}-{1:02d}: archived {2} minutes in {3}".format(
+                year, month, count, timer.interval))
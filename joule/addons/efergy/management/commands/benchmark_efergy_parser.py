@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import random
+
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from joule.utils import Timer
+
+from ...parsing import PARSE_ERRORS, FastLineParser, parse_line
+
+
+def generate_lines(count, start=None):
+    """
+    Returns «count» synthetic log-lines, one every 10 seconds from «start».
+    """
+    start = start or datetime(2015, 9, 1)
+    lines = []
+    for n in range(count):
+        timestamp = start + timedelta(seconds=10 * n)
+        lines.append("{0},{1:.6f}\n".format(
+            timestamp.strftime("%m/%d/%y,%H:%M:%S"),
+            random.uniform(100.0, 9000.0)))
+    return lines
+
+
+class Command(BaseCommand):
+
+    help = """Compares the throughput of parse_line() and FastLineParser:
+        `python manage.py benchmark_efergy_parser [--lines N] [log_file]`
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_name', nargs='?', type=str)
+        parser.add_argument('--lines', type=int, default=200000)
+
+    def handle(self, *args, **options):
+        if options['file_name']:
+            with open(options['file_name']) as log_file:
+                lines = log_file.readlines()[:options['lines']]
+        else:
+            lines = generate_lines(options['lines'])
+
+        with Timer() as slow:
+            expected = []
+            for line in lines:
+                try:
+                    expected.append(parse_line(line))
+                except PARSE_ERRORS:
+                    pass
+
+        parser = FastLineParser()
+        with Timer() as fast:
+            entries, failures = parser.parse_chunk(lines)
+
+        if entries != expected:
+            print("FastLineParser results differ from parse_line()!")
+
+        for label, timer in (("parse_line", slow),
+                             ("FastLineParser", fast)):
+            seconds = max(timer.interval.total_seconds(), 1e-9)
+            print("{label:15s} {lines} lines in {seconds:.3f}s: "
+                  "{rate:,.0f} lines/sec".format(
+                      label=label, lines=len(lines), seconds=seconds,
+                      rate=len(lines) / seconds))
+
+        print("Speed-up: {0:.1f}x".format(
+            slow.interval.total_seconds() /
+            max(fast.interval.total_seconds(), 1e-9)))
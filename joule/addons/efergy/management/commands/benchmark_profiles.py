@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg
+from django.utils import timezone
+
+from joule.utils import Timer
+
+from ...models import MinuteData
+from ...profiles import get_profiles, hourly_watt_minutes
+from ...utils import get_rollup_timezone
+
+
+def grouped_watt_minutes(first, last):
+    """
+    The reference implementation: a GROUP BY over every minute of the days
+    «first» to «last».
+    """
+    wm_hours = [0.0] * 24
+    rows = MinuteData.objects.filter(
+        local_date__gte=first, local_date__lte=last,
+    ).values('minute').annotate(avg=Avg('watts')).order_by('minute')
+    for row in rows:
+        wm_hours[row['minute'] // 60] += float(row['avg'])
+    return wm_hours
+
+
+class Command(BaseCommand):
+
+    help = """Compares averaging the stored day profiles of the last --days
+    days against a GROUP BY over their minute data.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365)
+
+    def handle(self, *args, **options):
+        tz = get_rollup_timezone()
+        last = timezone.now().astimezone(tz).date() - timedelta(days=1)
+        first = last - timedelta(days=options['days'] - 1)
+        dates = [first + timedelta(days=offset)
+                 for offset in range(options['days'])]
+
+        with Timer() as grouped:
+            expected = grouped_watt_minutes(first, last)
+
+        with Timer() as loading:
+            profiles = get_profiles(dates, tz)
+        with Timer() as reducing:
+            actual = hourly_watt_minutes(profiles)
+
+        print("GROUP BY over minute data:   {0}".format(grouped.interval))
+        print("Loading {0} day profiles:  {1}".format(
+            len(profiles), loading.interval))
+        print("Reducing the profiles:       {0}".format(reducing.interval))
+        print("Largest hourly difference:   {0:.9f} Wm".format(
+            max(abs(a - b) for a, b in zip(actual, expected))))
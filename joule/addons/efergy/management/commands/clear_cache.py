@@ -2,11 +2,36 @@
 
 from __future__ import unicode_literals
 
+from datetime import datetime, timedelta
+
 from django.core.cache import cache
 from django.core.management.base import BaseCommand
 
+from joule.caching import bump_dates
+
+
+def parse_date(date_string):
+    return datetime.strptime(date_string, '%Y-%m-%d').date()
+
 
 class Command(BaseCommand):
-    def handle(self, *args, **kwargs):
+
+    help = """Clears the whole cache, or with --dates FROM TO, only what was
+    cached for those local dates and their months.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dates', nargs=2, type=parse_date, default=None,
+            metavar=('FROM', 'TO'),
+            help='Only invalidate dates FROM to TO (YYYY-MM-DD, inclusive).')
+
+    def handle(self, *args, **options):
+        if options['dates']:
+            first, last = options['dates']
+            bump_dates([first + timedelta(days=offset)
+                        for offset in range((last - first).days + 1)])
+            print("Cache invalidated for {0} to {1}".format(first, last))
+            return
         cache.clear()
         print("Cache cleared")
@@ -6,68 +6,83 @@ import kronos
 
 from datetime import timedelta
 
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
-from ...models import EfergyData, MinuteData
+from joule.utils import Timer, safe_cache_key
 
+from ... import coverage
+from ...models import MinuteData
 
-def get_minute_coverage(now=None):
-
-    # Let's make sure its up-to-date before we make reports on it...
-
-    MinuteData.create_from_raw()
-
-    now = now or timezone.now()
-    now = now.replace(second=0) - timedelta(minutes=1)
 
-    one_day_ago = now - timedelta(days=1)
-    one_hour_ago = now - timedelta(hours=1)
-    one_week_ago = now - timedelta(days=7)
-    one_month_ago = now - timedelta(days=30)
+COVERAGE_CACHE_KEY = "joule:efergy:coverage"
 
-    day_logs = MinuteData.objects.filter(timestamp__gt=one_day_ago).count()
-    hour_logs = MinuteData.objects.filter(timestamp__gt=one_hour_ago).count()
-    week_logs = MinuteData.objects.filter(timestamp__gt=one_week_ago).count()
-    month_logs = MinuteData.objects.filter(timestamp__gt=one_month_ago).count()
 
-    hour_pct = float(hour_logs) / 60.0 * 100
-    day_pct = float(day_logs) / 1440.0 * 100
-    week_pct = float(week_logs) / (7 * 1440.0) * 100
-    month_pct = float(month_logs) / (30 * 1440.0) * 100
-
-    return hour_pct, day_pct, week_pct, month_pct
+def get_minute_coverage(now=None):
+    """
+    Returns the (hour, day, week, month) percentages of minutes that have
+    MinuteData, from the coverage index. This doesn't roll anything up
+    first, see rollup_minute_data.
+    """
+    return coverage.get_coverage(coverage.MINUTE, now)
 
 
 def get_raw_coverage(now=None):
-    now = now or timezone.now()
-    one_day_ago = now - timedelta(days=1)
-    one_hour_ago = now - timedelta(hours=1)
-    one_week_ago = now - timedelta(days=7)
-    one_month_ago = now - timedelta(days=30)
+    return coverage.get_coverage(coverage.RAW, now)
 
-    day_logs = EfergyData.objects.filter(timestamp__gt=one_day_ago).count()
-    hour_logs = EfergyData.objects.filter(timestamp__gt=one_hour_ago).count()
-    week_logs = EfergyData.objects.filter(timestamp__gt=one_week_ago).count()
-    month_logs = EfergyData.objects.filter(timestamp__gt=one_month_ago).count()
 
-    hour_pct = float(hour_logs) / 360.0 * 100
-    day_pct = float(day_logs) / 8640.0 * 100
-    week_pct = float(week_logs) / (7 * 8640.0) * 100
-    month_pct = float(month_logs) / (30 * 8640.0) * 100
-
-    return hour_pct, day_pct, week_pct, month_pct
+def update_cached_coverage(now=None):
+    """
+    Computes the minute coverage and caches it, along with when it was
+    computed and the timestamp of the latest MinuteData, for
+    get_cached_coverage(). Returns the cached dict.
+    """
+    now = now or timezone.now()
+    latest_minute = MinuteData.objects.order_by("-timestamp").values_list(
+        "timestamp", flat=True).first()
+    cached = {
+        "coverage": get_minute_coverage(now),
+        "computed_at": now,
+        "latest_minute": latest_minute,
+    }
+    cache.set(safe_cache_key(COVERAGE_CACHE_KEY), cached)
+    return cached
+
+
+def get_cached_coverage():
+    """
+    Returns the dict stored by update_cached_coverage(), or None.
+    """
+    return cache.get(safe_cache_key(COVERAGE_CACHE_KEY))
 
 
 @kronos.register("15 * * * *")
 class Command(BaseCommand):
 
-    help = """Reports percentage of data coverage.
+    help = """Reports percentage of data coverage, from the hourly coverage
+    index. Use --rebuild to recount the index from the tables, and --gaps
+    DAYS to list the hours without minute data over the last DAYS days.
     """
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true', default=False,
+            help='Recount the coverage index from the raw and minute data.')
+        parser.add_argument(
+            '--gaps', type=int, default=None, metavar='DAYS',
+            help='List the gaps in the minute data of the last DAYS days.')
+
+    def handle(self, *args, **options):
         now = timezone.now()
 
+        if options['rebuild']:
+            for kind in (coverage.RAW, coverage.MINUTE):
+                with Timer() as timer:
+                    counted = coverage.rebuild(kind)
+                print("Counted {0} {1} rows in {2}".format(
+                    counted, kind, timer.interval))
+
         (raw_hour_pct, raw_day_pct, raw_week_pct,
          raw_month_pct) = get_raw_coverage(now)
         print(
@@ -80,7 +95,7 @@ class Command(BaseCommand):
             ))
 
         (minute_hour_pct, minute_day_pct, minute_week_pct,
-         minute_month_pct) = get_minute_coverage(now)
+         minute_month_pct) = update_cached_coverage(now)["coverage"]
         print(
             "Minute data coverage (h,d,w,m): {hour:6.2f}% {day:6.2f}% "
             "{week:6.2f}% {month:6.2f}%".format(
@@ -89,3 +104,13 @@ class Command(BaseCommand):
                 week=minute_week_pct,
                 month=minute_month_pct
             ))
+
+        if options['gaps']:
+            end = coverage.hour_start(now)
+            gaps = coverage.get_gaps(
+                coverage.MINUTE, end - timedelta(days=options['gaps']), end)
+            for gap_start, gap_end in gaps:
+                print("No minute data from {0} to {1}".format(
+                    gap_start, gap_end))
+            print("{0} gaps in the last {1} days".format(
+                len(gaps), options['gaps']))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from joule.utils import Timer
+
+from ...coverage import MINUTE, RAW
+from ...export import CSV, FORMATS, iter_export
+from ...utils import get_rollup_timezone, local_day_range
+
+
+def parse_date(date_string):
+    return datetime.strptime(date_string, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+
+    help = """Streams the raw or minute data of a range of local dates as CSV
+    or NDJSON, to a file or to stdout, e.g.:
+        `python manage.py export_efergy_data minute 2015-01-01 2015-12-31 --format ndjson --gzip -o 2015.ndjson.gz`
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=(RAW, MINUTE))
+        parser.add_argument('first', type=parse_date, metavar='FROM',
+                            help='First local date (YYYY-MM-DD).')
+        parser.add_argument('last', type=parse_date, metavar='TO',
+                            help='Last local date (YYYY-MM-DD), inclusive.')
+        parser.add_argument(
+            '--format', choices=FORMATS, default=CSV,
+            help='Output format.')
+        parser.add_argument(
+            '--gzip', action='store_true', default=False,
+            help='Gzip the output.')
+        parser.add_argument(
+            '-o', '--output', default=None,
+            help='File to write to, instead of stdout.')
+
+    def handle(self, *args, **options):
+        tz = get_rollup_timezone()
+        start = local_day_range(options['first'], tz)[0]
+        end = local_day_range(options['last'], tz)[1]
+
+        if options['output']:
+            output = open(options['output'], 'wb')
+        else:
+            output = getattr(sys.stdout, 'buffer', sys.stdout)
+        size = 0
+        try:
+            with Timer() as timer:
+                for chunk in iter_export(options['kind'], start, end,
+                                         options['format'], options['gzip']):
+                    output.write(chunk)
+                    size += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+        # stdout may be the export itself.
+        self.stderr.write("Exported {0} bytes in {1}".format(
+            size, timer.interval))
@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import unicode_literals
+from __future__ import unicode_literals, division
 
-import tablib
-import pytz
+import csv
+import time
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from pytz.exceptions import InvalidTimeError
 
-from django.db.utils import IntegrityError
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django.utils import timezone
 
-from ...models import MinuteData
+from joule.daytypes import get_day_type
+
+from ... import coverage
+from ...rollup import SummaryRollup, insert_minutes
 
 
 def make_timestamp(date_string):
@@ -26,40 +33,127 @@ def make_timestamp(date_string):
         return None
 
 
+def parse_row(row, tz):
+    """
+    Converts a row of an Engage export into a MinuteData (timestamp, minute,
+    watts, local_date, day_type) tuple, or None if the row is unusable.
+    """
+    if len(row) < 2:
+        return None
+    timestamp = make_timestamp(row[0])
+    if timestamp is None:
+        return None
+    try:
+        timestamp = timezone.make_aware(timestamp, tz)
+        value = Decimal(row[1])
+    except (InvalidTimeError, InvalidOperation):
+        return None
+    if not value:
+        return None
+    return (timestamp, timestamp.hour * 60 + timestamp.minute, value,
+            timestamp.date(), get_day_type(timestamp.date()))
+
+
+class Progress(object):
+    """
+    Shared, thread-safe progress counters for concurrent imports.
+    """
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.rows = 0
+        self.inserted = 0
+        self.started = time.time()
+        self._next_report = self.started + interval
+        self._lock = Lock()
+
+    def update(self, rows, inserted):
+        with self._lock:
+            self.rows += rows
+            self.inserted += inserted
+            if time.time() >= self._next_report:
+                print(self.report())
+                self._next_report = time.time() + self.interval
+
+    def report(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return '{rows} rows read, {inserted} new minutes ({rate:.0f} ' \
+               'rows/sec)'.format(rows=self.rows, inserted=self.inserted,
+                                  rate=self.rows / elapsed)
+
+
+def import_file(file_name, progress, batch_size=1000):
+    """
+    Streams the Engage CSV export «file_name» into MinuteData, a batch of
+    «batch_size» rows at a time, ignoring minutes that are already stored.
+    Only the days that got new minutes are re-summarised. Returns (rows,
+    inserted).
+    """
+    tz = timezone.get_current_timezone()
+    rows = inserted = 0
+    first = last = None
+    dates = set()
+    batch = []
+    try:
+        with open(file_name, 'rb') as csv_file:
+            reader = csv.reader(csv_file)
+            next(reader, None)  # Skip the header row
+            for row in reader:
+                rows += 1
+                entry = parse_row(row, tz)
+                if entry is not None:
+                    batch.append(entry)
+                    if first is None or entry[0] < first:
+                        first = entry[0]
+                    if last is None or entry[0] > last:
+                        last = entry[0]
+                if len(batch) >= batch_size:
+                    count, batch_dates = insert_minutes(batch)
+                    inserted += count
+                    dates.update(batch_dates)
+                    progress.update(len(batch), count)
+                    batch = []
+            count, batch_dates = insert_minutes(batch)
+            inserted += count
+            dates.update(batch_dates)
+            progress.update(len(batch), count)
+        if inserted:
+            coverage.refresh(
+                coverage.MINUTE, first, last + timedelta(minutes=1))
+            SummaryRollup().update_days(sorted(dates))
+    finally:
+        # Each thread has its own connection, don't leave them dangling.
+        connection.close()
+    print('Imported {0} new minutes from {1}'.format(inserted, file_name))
+    return rows, inserted
+
+
 class Command(BaseCommand):
     help = """Load Efergy's Engage minute data directly in like this:
-        `python.py manage load_engage_data your_filename.csv`
+        `python.py manage load_engage_data your_filename.csv [...]`
     """
 
     def add_arguments(self, parser):
         parser.add_argument('file_name', nargs='+', type=str)
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of minutes to write per INSERT.')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of files to import concurrently.')
+        parser.add_argument(
+            '--report-interval', type=float, default=10.0,
+            help='Seconds between progress reports.')
 
     def handle(self, *args, **options):
-        file_name = options['file_name'][0]
-        data = tablib.Dataset()
-        data.csv = open(file_name).read()
-        counter = 0
-
-        for row in data:
-            timestamp = timezone.make_aware(
-                make_timestamp(row[0]), timezone.get_current_timezone())
-            try:
-                value = Decimal(row[1])
-            except InvalidOperation:
-                value = None
-
-            if timestamp and value:
-                minute = timestamp.hour * 60 + timestamp.minute
-                try:
-                    MinuteData.objects.create(
-                        # TODO: Obviously, this should be a setting somewhere
-                        timestamp=timestamp.astimezone(
-                            pytz.timezone("America/New_York")),
-                        minute=minute,
-                        watts=value
-                    )
-                    counter += 1
-                except IntegrityError:
-                    pass
-
-        print('Imported {0} new minutes from {1}'.format(counter, file_name))
+        file_names = options['file_name']
+        progress = Progress(options['report_interval'])
+        pool = ThreadPool(min(options['workers'], len(file_names)))
+        try:
+            pool.map(
+                lambda file_name: import_file(
+                    file_name, progress, options['batch_size']),
+                file_names)
+        finally:
+            pool.close()
+            pool.join()
+        print(progress.report())
@@ -1,43 +1,89 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import unicode_literals
+from __future__ import unicode_literals, division
 
+import os
 import sys
+import time
 
-from datetime import datetime
-from decimal import Decimal, InvalidOperation
-from threading import Thread
-from Queue import Queue, Empty
+from datetime import timedelta
+from threading import Lock, Thread
+from Queue import Queue, Empty, Full
 
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from django.db.utils import IntegrityError
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
-from ...models import EfergyData
+from ...backfill import Backfill, Checkpoints, expand_paths
+from ...ingest import BufferedWriter, DedupWindow
+from ...metrics import IngestMetrics
+from ...parsing import PARSE_ERRORS, FastLineParser, parse_line  # NOQA
+from ...spool import Spool
 
 
-def parse_line(line):
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+SPILL = 'spill'
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+
+class SpillFile(object):
     """
-    Given a log-line, convert to native datetime and Decimal formats.
+    An on-disk FIFO of lines used by NonBlockingStreamReader when its queue
+    is full and the overflow policy is SPILL.
     """
-    date_str, time_str, watts_str = line.split(',')
-    timestamp = datetime.strptime(
-        date_str + "|" + time_str, "%m/%d/%y|%H:%M:%S")
-    timestamp = timezone.make_aware(timestamp, timezone.get_current_timezone())
-    watts = Decimal(watts_str)
-    return {'timestamp': timestamp, 'watts': watts}
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._lock = Lock()
+        self._file = open(file_name, 'w+')
+        self._read_pos = 0
+        self.depth = 0
+
+    def put(self, line):
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(line)
+            self.depth += 1
+
+    def get(self):
+        with self._lock:
+            if not self.depth:
+                return None
+            self._file.seek(self._read_pos)
+            line = self._file.readline()
+            self._read_pos = self._file.tell()
+            self.depth -= 1
+            if not self.depth:
+                # Drained, start over with an empty file.
+                self._file.seek(0)
+                self._file.truncate()
+                self._read_pos = 0
+            return line
 
 
 class NonBlockingStreamReader:
 
-    def __init__(self, stream):
+    def __init__(self, stream, maxsize=0, overflow=BLOCK, spill_file=None,
+                 metrics=None):
         """
-        stream: the stream to read from.
-                Usually a process' stdout or stderr.
+        stream:     the stream to read from.
+                    Usually a process' stdout or stderr.
+        maxsize:    bound of the in-memory queue, 0 for unbounded.
+        overflow:   what to do with a new line when the queue is full. One of
+                    BLOCK (stop reading «stream»), DROP_OLDEST (discard the
+                    oldest queued line) or SPILL (queue it in «spill_file»).
+        metrics:    an optional IngestMetrics to count lines in and out.
         """
 
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: {0}'.format(overflow))
+        if overflow == SPILL and not spill_file:
+            raise ValueError('The spill overflow policy needs a spill_file.')
+
         self._s = stream
-        self._q = Queue()
+        self._q = Queue(maxsize)
+        self._spill = SpillFile(spill_file) if overflow == SPILL else None
+        self.overflow = overflow
+        self.metrics = metrics or IngestMetrics()
 
         def _populate_queue(stream, queue):
             """
@@ -47,7 +93,8 @@ class NonBlockingStreamReader:
             while True:
                 line = stream.readline()
                 if line:
-                    queue.put(line)
+                    self.metrics.incr('lines_in')
+                    self._put(line)
                 else:
                     raise UnexpectedEndOfStream
 
@@ -55,11 +102,54 @@ class NonBlockingStreamReader:
         self._t.daemon = True
         self._t.start()  # start collecting lines from the stream
 
+    def _put(self, line):
+        if self.overflow == BLOCK:
+            self._q.put(line)
+            return
+
+        if self._spill is not None and self._spill.depth:
+            # Keep the lines in order while there is anything spilled.
+            self._spill.put(line)
+            self.metrics.incr('spilled')
+            return
+
+        while True:
+            try:
+                self._q.put_nowait(line)
+                return
+            except Full:
+                if self._spill is not None:
+                    self._spill.put(line)
+                    self.metrics.incr('spilled')
+                    return
+            try:
+                self._q.get_nowait()
+                self.metrics.incr('dropped')
+            except Empty:
+                pass
+
+    @property
+    def depth(self):
+        """
+        The number of lines read from the stream but not yet consumed.
+        """
+        return self._q.qsize() + (self._spill.depth if self._spill else 0)
+
     def read_line(self, timeout=None):
         try:
-            return self._q.get(block=timeout is not None, timeout=timeout)
+            line = self._q.get_nowait()
         except Empty:
-            return None
+            line = self._spill.get() if self._spill else None
+            if line is None:
+                try:
+                    line = self._q.get(
+                        block=timeout is not None, timeout=timeout)
+                except Empty:
+                    line = None
+        if line is not None:
+            self.metrics.incr('lines_out')
+        self.metrics.set_gauge('queue_depth', self.depth)
+        return line
 
 
 class UnexpectedEndOfStream(Exception):
@@ -70,28 +160,163 @@ class Command(BaseCommand):
 
     help = """Pipe Efergy data directly in like this:
         `cat efergy_data.log | python manage.py log_efergy_data`
+    or load (optionally gzipped) archived logs in parallel like this:
+        `python manage.py log_efergy_data --backfill 'logs/efergy.log*'`
     """
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*', type=str,
+            help='Log files or glob patterns to load with --backfill.')
+        parser.add_argument(
+            '--backfill', action='store_true', default=False,
+            help='Load the given log files instead of reading stdin.')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of parsing processes for --backfill.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=20000,
+            help='Number of lines per --backfill chunk.')
+        parser.add_argument(
+            '--checkpoint', type=str, default='efergy_backfill.json',
+            help='File recording --backfill progress per log file.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of samples to write per INSERT.')
+        parser.add_argument(
+            '--max-latency', type=float, default=5.0,
+            help='Maximum seconds a sample may wait before being written.')
+        parser.add_argument(
+            '--report-interval', type=float, default=300.0,
+            help='Seconds between throughput reports.')
+        parser.add_argument(
+            '--queue-size', type=int, default=10000,
+            help='Maximum number of lines held in memory, 0 for unbounded.')
+        parser.add_argument(
+            '--overflow', choices=OVERFLOW_POLICIES, default=BLOCK,
+            help='What to do with new lines while the queue is full.')
+        parser.add_argument(
+            '--spill-file', type=str, default='efergy_spill.log',
+            help='Where to queue lines with --overflow=spill.')
+        parser.add_argument(
+            '--dedup-size', type=int, default=20000,
+            help='Number of recent samples remembered to drop duplicates '
+                 'early, 0 to disable.')
+        parser.add_argument(
+            '--dedup-hours', type=float, default=24.0,
+            help='How far back the duplicate window reaches.')
+        parser.add_argument(
+            '--spool-dir', type=str,
+            default=getattr(settings, 'EFERGY_SPOOL_DIR', 'efergy_spool'),
+            help='Directory of the write-ahead spool, empty to disable it.')
+        parser.add_argument(
+            '--metrics-file', type=str, default=None,
+            help='File to write Prometheus-style ingestion metrics to.')
+        parser.add_argument(
+            '--metrics-interval', type=float, default=10.0,
+            help='Seconds between updates of --metrics-file.')
+
+    def get_dedup_window(self, options):
+        if not options['dedup_size']:
+            return None
+        return DedupWindow(max_size=options['dedup_size'],
+                           span=timedelta(hours=options['dedup_hours']))
+
+    def report(self, writer):
+        if writer.dedup is None:
+            return writer.stats.report()
+        return '{0}; {1}'.format(writer.stats.report(), writer.dedup.report())
+
+    def backfill(self, options):
+        paths = expand_paths(options['files'])
+        if not paths:
+            raise CommandError('No log files match {0}'.format(
+                ' '.join(options['files'])))
+        backfill = Backfill(
+            paths, Checkpoints(options['checkpoint']),
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            dedup=self.get_dedup_window(options))
+        backfill.run()
+        print(self.report(backfill.writer))
+
+    def write_metrics(self, metrics, writer, metrics_file):
+        metrics.set_counter('inserted', writer.stats.inserted)
+        metrics.set_counter('duplicates', writer.stats.duplicates)
+        metrics.set_counter('rejected', writer.stats.rejected)
+        metrics.set_gauge('buffered', len(writer))
+        if writer.dedup is not None:
+            metrics.set_counter('dedup_hits', writer.dedup.hits)
+            metrics.set_counter('dedup_misses', writer.dedup.misses)
+        try:
+            metrics.write(metrics_file)
+        except (IOError, OSError) as error:
+            print('Unable to write metrics: {0}'.format(error))
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            return self.backfill(options)
+        elif options['files']:
+            raise CommandError('Log files can only be given with --backfill.')
+
+        metrics = IngestMetrics()
         if not sys.stdin.isatty():
-            input_stream = NonBlockingStreamReader(sys.stdin)
+            input_stream = NonBlockingStreamReader(
+                sys.stdin,
+                maxsize=options['queue_size'],
+                overflow=options['overflow'],
+                spill_file=options['spill_file'],
+                metrics=metrics)
         else:
             print(self.help)
             return
 
-        while True:
-            line = input_stream.read_line(0.1)
-            if line:
-                try:
-                    entry = parse_line(line)
-                except ValueError:
-                    print('Skipping unparsable line: {0}.'.format(line))
-                    continue
+        parser = FastLineParser()
+        spool = Spool(options['spool_dir']) if options['spool_dir'] else None
+        dedup = self.get_dedup_window(options)
+        if dedup is not None:
+            print('Seeded duplicate window with {0} samples'.format(
+                dedup.seed()))
+        writer = BufferedWriter(batch_size=options['batch_size'],
+                                max_latency=options['max_latency'],
+                                spool=spool, dedup=dedup)
+        if spool is not None:
+            replayed = writer.recover()
+            if replayed and replayed[0]:
+                count, seconds = replayed
+                print('Replayed {0} spooled samples in {1:.2f}s '
+                      '({2:.1f} rows/sec)'.format(
+                          count, seconds, count / max(seconds, 1e-9)))
+        report_interval = options['report_interval']
+        next_report = time.time() + report_interval
+        metrics_file = options['metrics_file']
+        metrics_interval = options['metrics_interval']
+        next_metrics = time.time()
 
-                try:
-                    EfergyData.objects.create(**entry)
-                except IntegrityError:
-                    # Ignore duplicate entries
-                    print('Skipping duplicate: {watts} @ {timestamp}'.format(**entry))
-                except InvalidOperation:
-                    print('Skipping bogus data {watts} @ {timestamp}'.format(**entry))
+        try:
+            while True:
+                line = input_stream.read_line(0.1)
+                if line:
+                    try:
+                        entry = parser.parse(line)
+                    except PARSE_ERRORS:
+                        print('Skipping unparsable line: {0}.'.format(line))
+                        writer.stats.rejected += 1
+                        metrics.incr('parse_failures')
+                    else:
+                        writer.add(entry)
+
+                writer.poll()
+
+                if metrics_file and time.time() >= next_metrics:
+                    self.write_metrics(metrics, writer, metrics_file)
+                    next_metrics = time.time() + metrics_interval
+
+                if time.time() >= next_report:
+                    print('{0}; {1} lines queued'.format(
+                        self.report(writer), input_stream.depth))
+                    next_report = time.time() + report_interval
+        finally:
+            writer.flush()
+            print(self.report(writer))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import kronos
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...retention import RetentionPolicy, estimate_row_bytes
+
+
+@kronos.register("30 3 * * *")
+class Command(BaseCommand):
+
+    help = """Archives and removes raw Efergy data that is older than
+    EFERGY_RAW_RETENTION_DAYS (default 90) and fully rolled up into minute
+    data. Use --dry-run to see what would be reclaimed.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'EFERGY_RAW_RETENTION_DAYS', 90),
+            help='Keep raw data for this many days.')
+        parser.add_argument(
+            '--archive-dir', type=str,
+            default=getattr(settings, 'EFERGY_ARCHIVE_DIR', 'efergy_archive'),
+            help='Where to write the gzipped CSV archives.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows to delete per statement.')
+        parser.add_argument(
+            '--pause', type=float, default=0.1,
+            help='Seconds to wait between deletes.')
+        parser.add_argument(
+            '--dry-run', action='store_true', default=False,
+            help='Only report what would be archived and deleted.')
+
+    def handle(self, *args, **options):
+        policy = RetentionPolicy(
+            timedelta(days=options['days']), options['archive_dir'],
+            batch_size=options['batch_size'], pause=options['pause'])
+        dry_run = options['dry_run']
+
+        total_rows = 0
+        for date in policy.expired_dates(timezone.now()):
+            rows, missing = policy.prune(date, dry_run=dry_run)
+            if missing:
+                print("{0}: skipped, {1} minutes are not rolled up yet, "
+                      "starting at {2}".format(date, len(missing), missing[0]))
+            elif rows:
+                print("{0}: {1} {2} rows".format(
+                    date, "would delete" if dry_run else "archived and deleted",
+                    rows))
+            total_rows += rows
+
+        reclaimed = total_rows * estimate_row_bytes()
+        print("{0} {1} rows, about {2:.1f} MB".format(
+            "Would reclaim" if dry_run else "Reclaimed", total_rows,
+            reclaimed / (1024 * 1024)))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import kronos
+
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from joule.utils import Timer
+
+from ...rollup import MinuteRollup, SummaryRollup
+from .data_coverage import update_cached_coverage
+
+
+def parse_date(date_string):
+    return datetime.strptime(date_string, '%Y-%m-%d').date()
+
+
+@kronos.register("* * * * *")
+class Command(BaseCommand):
+
+    help = """Averages newly received raw Efergy data into minute data, then
+    refreshes the cached data coverage the bill view shows.
+        `python manage.py rollup_minute_data [--engine python|mysql]`
+    Only one rollup runs at a time, a run that finds another one in progress
+    does nothing.
+    Use --verify HOURS to check that both engines agree on the last HOURS of
+    raw data, without writing anything. Use --rebuild-summaries to
+    re-summarise the day data of a range of dates.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engine', choices=('auto', 'python', 'mysql'), default='auto',
+            help='Which rollup implementation to use.')
+        parser.add_argument(
+            '--verify', type=float, default=None, metavar='HOURS',
+            help='Compare both engines over the last HOURS instead.')
+        parser.add_argument(
+            '--rebuild-summaries', nargs=2, type=parse_date, default=None,
+            metavar=('FROM', 'TO'),
+            help='Re-summarise day data for dates FROM to TO '
+                 '(YYYY-MM-DD, inclusive) instead.')
+
+    def handle(self, *args, **options):
+        rollup = MinuteRollup()
+
+        if options['rebuild_summaries']:
+            first, last = options['rebuild_summaries']
+            summaries = SummaryRollup(rollup.tz)
+            with Timer() as timer:
+                summaries.update_days([
+                    first + timedelta(days=offset)
+                    for offset in range((last - first).days + 1)])
+            print("Re-summarised {0} to {1} in {2}".format(
+                first, last, timer.interval))
+            return
+
+        if options['verify']:
+            end = rollup.get_end()
+            start = end - timedelta(hours=options['verify'])
+            differences = rollup.verify(start, end)
+            for python_row, mysql_row in differences:
+                print("python: {0}, mysql: {1}".format(python_row, mysql_row))
+            print("{0} differences between {1} and {2}".format(
+                len(differences), start, end))
+            return
+
+        fast_path = {
+            'auto': None, 'python': False, 'mysql': True}[options['engine']]
+        with Timer() as timer:
+            created = rollup.run_exclusive(fast_path=fast_path)
+        if created is None:
+            print("{0}:: Another rollup is running, skipped".format(
+                timezone.now()))
+            return
+        update_cached_coverage()
+        print("{0}:: Created {1} minutes in {2}".format(
+            timezone.now(), created, timer.interval))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import os
+import time
+
+from collections import defaultdict
+from threading import Lock
+
+
+class IngestMetrics(object):
+    """
+    Thread-safe counters and gauges for the ingestion pipeline.
+
+    render() produces the Prometheus text exposition format, and write()
+    saves that atomically to a file, so an operator can scrape it with the
+    node_exporter "textfile" collector or simply `cat` it.
+    """
+    def __init__(self, prefix='efergy_ingest', clock=time.time):
+        self.prefix = prefix
+        self.clock = clock
+        self.counters = defaultdict(int)
+        self.gauges = dict()
+        self._lock = Lock()
+        self._last_time = clock()
+        self._last_counters = dict()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def set_counter(self, name, value):
+        """
+        For counters maintained elsewhere (e.g. WriterStats).
+        """
+        with self._lock:
+            self.counters[name] = value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def rates(self):
+        """
+        Returns a dict of per-second rates for every counter since the
+        previous call, and starts a new interval.
+        """
+        with self._lock:
+            now = self.clock()
+            interval = max(now - self._last_time, 1e-9)
+            rates = dict(
+                (name, (value - self._last_counters.get(name, 0)) / interval)
+                for name, value in self.counters.items())
+            self._last_time = now
+            self._last_counters = dict(self.counters)
+        return rates
+
+    def render(self):
+        rates = self.rates()
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        lines = []
+        for name, value in counters:
+            lines.append("# TYPE {0}_{1}_total counter".format(
+                self.prefix, name))
+            lines.append("{0}_{1}_total {2}".format(self.prefix, name, value))
+        for name, value in gauges:
+            lines.append("# TYPE {0}_{1} gauge".format(self.prefix, name))
+            lines.append("{0}_{1} {2}".format(self.prefix, name, value))
+        for name, value in sorted(rates.items()):
+            lines.append("# TYPE {0}_{1}_per_second gauge".format(
+                self.prefix, name))
+            lines.append("{0}_{1}_per_second {2:.3f}".format(
+                self.prefix, name, value))
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_name):
+        temp_name = file_name + '.tmp'
+        with open(temp_name, 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.rename(temp_name, file_name)
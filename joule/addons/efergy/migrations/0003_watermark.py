@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('efergy', '0002_auto_20150829_1819'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=64, verbose_name='name')),
+                ('timestamp', models.DateTimeField(verbose_name='timestamp')),
+            ],
+            options={
+                'verbose_name': 'watermark',
+                'verbose_name_plural': 'watermarks',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('efergy', '0003_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayData',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField(unique=True, verbose_name='date')),
+                ('energy', models.DecimalField(verbose_name='energy', max_digits=12, decimal_places=6)),
+                ('min_watts', models.DecimalField(verbose_name='min. watts', max_digits=12, decimal_places=6)),
+                ('max_watts', models.DecimalField(verbose_name='max. watts', max_digits=12, decimal_places=6)),
+                ('avg_watts', models.DecimalField(verbose_name='avg. watts', max_digits=12, decimal_places=6)),
+                ('samples', models.PositiveIntegerField(verbose_name='samples')),
+                ('high', models.DecimalField(null=True, verbose_name='high', max_digits=5, decimal_places=2, blank=True)),
+                ('low', models.DecimalField(null=True, verbose_name='low', max_digits=5, decimal_places=2, blank=True)),
+            ],
+            options={
+                'verbose_name': 'day datum',
+                'verbose_name_plural': 'day data',
+            },
+        ),
+    ]
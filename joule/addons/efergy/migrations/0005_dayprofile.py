@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('efergy', '0004_daydata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayProfile',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField(unique=True, verbose_name='date')),
+                ('watts', models.BinaryField(verbose_name='watts')),
+                ('samples', models.BinaryField(verbose_name='samples')),
+            ],
+            options={
+                'verbose_name': 'day profile',
+                'verbose_name_plural': 'day profiles',
+            },
+        ),
+    ]
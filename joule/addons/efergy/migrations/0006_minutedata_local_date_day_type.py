@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import models, migrations
+
+from joule.daytypes import get_day_type
+from joule.addons.efergy.utils import (
+    get_rollup_timezone,
+    local_dates,
+    local_day_range,
+)
+
+
+def fill_local_dates(apps, schema_editor):
+    """
+    Sets local_date and day_type on the existing MinuteData, one local day
+    (i.e. one UPDATE over at most ~1440 rows) at a time.
+    """
+    MinuteData = apps.get_model('efergy', 'MinuteData')
+    first = MinuteData.objects.order_by('timestamp').first()
+    last = MinuteData.objects.order_by('-timestamp').first()
+    if first is None:
+        return
+    tz = get_rollup_timezone()
+    # local_dates() excludes its end, but the last row must be included.
+    for date in local_dates(
+            first.timestamp, last.timestamp + timedelta(microseconds=1), tz):
+        start, end = local_day_range(date, tz)
+        MinuteData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).update(local_date=date, day_type=get_day_type(date))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('efergy', '0005_dayprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='minutedata',
+            name='local_date',
+            field=models.DateField(null=True, verbose_name='local date', blank=True),
+        ),
+        migrations.AddField(
+            model_name='minutedata',
+            name='day_type',
+            field=models.CharField(blank=True, max_length=7, null=True, verbose_name='day type', choices=[('weekend', 'weekend'), ('summer', 'summer'), ('winter', 'winter')]),
+        ),
+        migrations.RunPython(fill_local_dates, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='minutedata',
+            index_together=set([('local_date', 'minute'), ('day_type', 'local_date', 'minute')]),
+        ),
+    ]
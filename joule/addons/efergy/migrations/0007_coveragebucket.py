@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import Counter
+from datetime import timedelta
+
+from django.db import models, migrations
+
+from joule.addons.efergy.coverage import hour_start
+
+
+def fill_coverage_buckets(apps, schema_editor):
+    """
+    Counts the existing EfergyData and MinuteData into CoverageBuckets, like
+    `data_coverage --rebuild` does, one day of each table at a time.
+    """
+    CoverageBucket = apps.get_model('efergy', 'CoverageBucket')
+    for kind, model_name in (('raw', 'EfergyData'), ('minute', 'MinuteData')):
+        model = apps.get_model('efergy', model_name)
+        first = model.objects.order_by('timestamp').first()
+        if first is None:
+            continue
+        last = model.objects.order_by('-timestamp').first()
+        window_start = hour_start(first.timestamp)
+        while window_start <= last.timestamp:
+            window_end = window_start + timedelta(days=1)
+            timestamps = model.objects.filter(
+                timestamp__gte=window_start, timestamp__lt=window_end,
+            ).values_list('timestamp', flat=True)
+            counts = Counter(
+                hour_start(timestamp) for timestamp in timestamps.iterator())
+            CoverageBucket.objects.bulk_create([
+                CoverageBucket(kind=kind, hour=hour, count=count)
+                for hour, count in sorted(counts.items())])
+            window_start = window_end
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('efergy', '0006_minutedata_local_date_day_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageBucket',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=6, verbose_name='kind', choices=[('raw', 'raw'), ('minute', 'minute')])),
+                ('hour', models.DateTimeField(verbose_name='hour')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='count')),
+            ],
+            options={
+                'verbose_name': 'coverage bucket',
+                'verbose_name_plural': 'coverage buckets',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='coveragebucket',
+            unique_together=set([('kind', 'hour')]),
+        ),
+        migrations.RunPython(fill_coverage_buckets, migrations.RunPython.noop),
+    ]
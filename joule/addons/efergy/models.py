@@ -3,14 +3,15 @@
 from __future__ import unicode_literals
 from django.utils.encoding import python_2_unicode_compatible
 
-from datetime import datetime, timedelta
 from tzlocal import get_localzone
-import pytz
 
 from django.db import models, connection
-from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
+from joule.daytypes import WEEKEND, SUMMER, WINTER, get_day_type
+
+from .utils import local_dates, local_day_range
+
 
 @python_2_unicode_compatible
 class EfergyData(models.Model):
@@ -37,31 +38,54 @@ class MinuteData(models.Model):
     Efergy data on a per minute basis. This is averaged from the raw log data
     (which is every 10 seconds). Minute is from 0 - 1439 and reflects the number
     of minutes past since midnight.
+
+    «local_date» and «day_type» are the local date of the minute and its
+    tariff day type (see joule.daytypes), so that a day's, or a tariff's,
+    minutes can be selected by an index range rather than by timestamp
+    arithmetic.
     """
+    DAY_TYPE_CHOICES = (
+        (WEEKEND, _('weekend')),
+        (SUMMER, _('summer')),
+        (WINTER, _('winter')),
+    )
+
     timestamp = models.DateTimeField(_('timestamp'), unique=True)
     minute = models.PositiveSmallIntegerField(_('minute'))
     watts = models.DecimalField(_('watts'), max_digits=12, decimal_places=6)
+    local_date = models.DateField(_('local date'), null=True, blank=True)
+    day_type = models.CharField(
+        _('day type'), max_length=7, choices=DAY_TYPE_CHOICES, null=True,
+        blank=True)
 
     class Meta:
         verbose_name = _('minute datum')
         verbose_name_plural = _('minute data')
+        index_together = [
+            ('local_date', 'minute'),
+            ('day_type', 'local_date', 'minute'),
+        ]
 
     @classmethod
-    def create_from_raw(cls):
+    def create_from_raw(cls, fast_path=None):
         """
-        Creates MinuteData from raw EfergyData
+        Creates MinuteData from raw EfergyData received since the last run,
+        unless a rollup is already running, in which case it returns None.
+        See rollup.MinuteRollup.
         """
-        try:
-            latest_minute = cls.objects.latest('timestamp')
-            start_time = latest_minute.timestamp
-            # Why do I have to do this?!?!
-            start_time = start_time + timedelta(minutes=1)
-            start_time = start_time.astimezone(get_localzone())
-        except cls.DoesNotExist:
-            start_time = pytz.utc.localize(datetime(2000, 1, 1, 0, 0, 0))
+        from .rollup import MinuteRollup
+        return MinuteRollup().run_exclusive(fast_path=fast_path)
 
-        last_minute = now().replace(second=0, microsecond=0)
-        end_time = last_minute.astimezone(get_localzone())
+    @classmethod
+    def create_from_raw_mysql(cls, start_time, end_time):
+        """
+        Creates MinuteData from raw EfergyData in [start_time, end_time)
+        with a single INSERT ... SELECT, leaving stored minutes alone.
+        Returns the number of minutes inserted.
+        """
+        # Why do I have to do this?!?!
+        start_time = start_time.astimezone(get_localzone())
+        end_time = end_time.astimezone(get_localzone())
 
         cursor = connection.cursor()
         # NOTE: This code is MySQL-specific!
@@ -69,19 +93,166 @@ class MinuteData(models.Model):
         # is important to explicitly convert the value to the local timezone
         # first otherwise, the calculations will be for UTC.
         cursor.execute("""
-            INSERT INTO efergy_minutedata (
+            INSERT IGNORE INTO efergy_minutedata (`timestamp`, `minute`, `watts`) (
                 SELECT
-                    NULL,
                     FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(`timestamp`)/60)*60) as 'timestamp',
                     HOUR(CONVERT_TZ(`timestamp`, '+00:00', @@global.time_zone)) * 60 + MINUTE(CONVERT_TZ(`timestamp`, '+00:00', @@global.time_zone)) as 'minute',
                     TRUNCATE(AVG(`watts`), 6) as 'watts'
                 FROM `efergy_efergydata`
                 WHERE `timestamp` >= %s AND `timestamp` < %s
-                GROUP BY 2
-            ) ON DUPLICATE KEY UPDATE `timestamp`=`timestamp`""",
+                GROUP BY 1
+            )""",
             (start_time, end_time))
+        return cursor.rowcount
+
+    @classmethod
+    def fill_local_dates(cls, start_time, end_time, tz):
+        """
+        Sets «local_date» and «day_type» of the rows in [start_time,
+        end_time) that don't have them yet, with one UPDATE per local day.
+        Returns the list of the local dates of the rows updated.
+        """
+        updated = []
+        for date in local_dates(start_time, end_time, tz):
+            day_start, day_end = local_day_range(date, tz)
+            if cls.objects.filter(
+                    timestamp__gte=max(day_start, start_time),
+                    timestamp__lt=min(day_end, end_time),
+                    local_date__isnull=True,
+            ).update(local_date=date, day_type=get_day_type(date)):
+                updated.append(date)
+        return updated
 
     def __str__(self):
         return "{watts}W measured at {timestamp}".format(
             watts=self.watts, timestamp=self.timestamp)
 
+
+@python_2_unicode_compatible
+class DayData(models.Model):
+    """
+    A summary of the MinuteData of one local day, along with the day's high
+    and low outside temperatures. «energy» is in kWHrs and «samples» is the
+    number of minutes recorded.
+    """
+    date = models.DateField(_('date'), unique=True)
+    energy = models.DecimalField(_('energy'), max_digits=12, decimal_places=6)
+    min_watts = models.DecimalField(
+        _('min. watts'), max_digits=12, decimal_places=6)
+    max_watts = models.DecimalField(
+        _('max. watts'), max_digits=12, decimal_places=6)
+    avg_watts = models.DecimalField(
+        _('avg. watts'), max_digits=12, decimal_places=6)
+    samples = models.PositiveIntegerField(_('samples'))
+    high = models.DecimalField(
+        _('high'), max_digits=5, decimal_places=2, null=True, blank=True)
+    low = models.DecimalField(
+        _('low'), max_digits=5, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('day datum')
+        verbose_name_plural = _('day data')
+
+    def __str__(self):
+        return "{energy}kWHrs on {date}".format(
+            energy=self.energy, date=self.date)
+
+
+@python_2_unicode_compatible
+class DayProfile(models.Model):
+    """
+    The consumption profile of one closed local day: for each of its 1440
+    minutes, the average watts («watts», packed float64) and the number of
+    MinuteData rows averaged («samples», packed uint16). See profiles.py.
+    """
+    date = models.DateField(_('date'), unique=True)
+    watts = models.BinaryField(_('watts'))
+    samples = models.BinaryField(_('samples'))
+
+    class Meta:
+        verbose_name = _('day profile')
+        verbose_name_plural = _('day profiles')
+
+    def __str__(self):
+        return "Profile of {date}".format(date=self.date)
+
+
+@python_2_unicode_compatible
+class Watermark(models.Model):
+    """
+    Records how far a named incremental process (e.g. the minute rollup) has
+    got, so that the next run can carry on from there.
+    """
+    name = models.CharField(_('name'), max_length=64, unique=True)
+    timestamp = models.DateTimeField(_('timestamp'))
+
+    class Meta:
+        verbose_name = _('watermark')
+        verbose_name_plural = _('watermarks')
+
+    @classmethod
+    def get(cls, name, default=None):
+        try:
+            return cls.objects.get(name=name).timestamp
+        except cls.DoesNotExist:
+            return default
+
+    @classmethod
+    def set(cls, name, timestamp):
+        cls.objects.update_or_create(
+            name=name, defaults={'timestamp': timestamp})
+
+    @classmethod
+    def lower(cls, name, timestamp):
+        """
+        Moves «name» back to «timestamp» if it is later, creating it if need
+        be. Never moves it forward.
+        """
+        if not cls.objects.filter(
+                name=name, timestamp__gt=timestamp).update(timestamp=timestamp):
+            cls.objects.get_or_create(
+                name=name, defaults={'timestamp': timestamp})
+
+    @classmethod
+    def pop(cls, name):
+        """
+        Removes «name» and returns its timestamp, or None. If it is lowered
+        in the meantime it isn't removed, and the next pop() returns it.
+        """
+        timestamp = cls.get(name)
+        if timestamp is not None:
+            cls.objects.filter(name=name, timestamp=timestamp).delete()
+        return timestamp
+
+    def __str__(self):
+        return "{name} @ {timestamp}".format(
+            name=self.name, timestamp=self.timestamp)
+
+
+@python_2_unicode_compatible
+class CoverageBucket(models.Model):
+    """
+    The number of rows of EfergyData («kind» raw) or MinuteData («kind»
+    minute) stored for the UTC hour starting at «hour». Kept up to date as
+    data is written, so that coverage can be reported without counting the
+    tables themselves. See coverage.py.
+    """
+    RAW = 'raw'
+    MINUTE = 'minute'
+    KIND_CHOICES = (
+        (RAW, _('raw')),
+        (MINUTE, _('minute')),
+    )
+
+    kind = models.CharField(_('kind'), max_length=6, choices=KIND_CHOICES)
+    hour = models.DateTimeField(_('hour'))
+    count = models.PositiveIntegerField(_('count'), default=0)
+
+    class Meta:
+        verbose_name = _('coverage bucket')
+        verbose_name_plural = _('coverage buckets')
+        unique_together = [('kind', 'hour', ), ]
+
+    def __str__(self):
+        return "{count} {kind} rows during {hour}".format(
+            count=self.count, kind=self.kind, hour=self.hour)
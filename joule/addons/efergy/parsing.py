@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from pytz.exceptions import InvalidTimeError
+
+
+# Everything parse_line() raises for a line it can't make sense of, including
+# local times that are skipped or repeated when DST starts or ends.
+PARSE_ERRORS = (ValueError, InvalidOperation, InvalidTimeError)
+
+
+def parse_line(line, tz=None):
+    """
+    Given a log-line, convert to native datetime and Decimal formats. The
+    local time is read in «tz», by default the current timezone.
+    """
+    date_str, time_str, watts_str = line.split(',')
+    timestamp = datetime.strptime(
+        date_str + "|" + time_str, "%m/%d/%y|%H:%M:%S")
+    timestamp = timezone.make_aware(
+        timestamp, tz or timezone.get_current_timezone())
+    watts = Decimal(watts_str)
+    return {'timestamp': timestamp, 'watts': watts}
+
+
+class FastLineParser(object):
+    """
+    A specialised parse_line() for the fixed "%m/%d/%y,%H:%M:%S,watts" layout
+    written by the Efergy logger. Rather than running strptime() and
+    make_aware() on every line, the fields are sliced out directly and the
+    tz-aware offset is looked up once per date.
+
+    Anything that doesn't fit the fixed layout, and any date on which the
+    local UTC offset changes (DST transitions, even those at midnight), is
+    handed to parse_line() in the same timezone, so that the results are
+    always identical to it, including the errors raised.
+    """
+    max_cached_days = 1024
+
+    def __init__(self, tz=None):
+        self.tz = tz or timezone.get_current_timezone()
+        self._days = dict()
+
+    def get_day(self, date_str):
+        """
+        Returns (year, month, day, tzinfo) for a "%m/%d/%y" string, or None if
+        the string or the date needs the slow path.
+        """
+        try:
+            return self._days[date_str]
+        except KeyError:
+            pass
+
+        day = None
+        if (len(date_str) == 8 and date_str[2] == '/' and
+                date_str[5] == '/' and
+                (date_str[0:2] + date_str[3:5] + date_str[6:8]).isdigit()):
+            # Same pivot as strptime's %y: 69-99 are 1900s, 00-68 are 2000s
+            year = int(date_str[6:8])
+            year += 1900 if year >= 69 else 2000
+            try:
+                start = datetime(year, int(date_str[0:2]), int(date_str[3:5]))
+            except ValueError:
+                start = None
+            if start is not None:
+                end = start.replace(hour=23, minute=59, second=59)
+                try:
+                    start_aware = timezone.make_aware(start, self.tz)
+                    end_aware = timezone.make_aware(end, self.tz)
+                except InvalidTimeError:
+                    # The offset changes right at midnight.
+                    start_aware = end_aware = None
+                if (start_aware is not None and
+                        start_aware.utcoffset() == end_aware.utcoffset()):
+                    day = (start.year, start.month, start.day,
+                           start_aware.tzinfo)
+
+        if len(self._days) >= self.max_cached_days:
+            self._days.clear()
+        self._days[date_str] = day
+        return day
+
+    def parse(self, line):
+        date_str, time_str, watts_str = line.split(',')
+        day = self.get_day(date_str)
+        if (day is None or len(time_str) != 8 or
+                time_str[2] != ':' or time_str[5] != ':' or
+                not (time_str[0:2] + time_str[3:5] + time_str[6:8]).isdigit()):
+            return parse_line(line, self.tz)
+        year, month, mday, tzinfo = day
+        timestamp = datetime(year, month, mday, int(time_str[0:2]),
+                             int(time_str[3:5]), int(time_str[6:8]),
+                             tzinfo=tzinfo)
+        return {'timestamp': timestamp, 'watts': Decimal(watts_str)}
+
+    def parse_chunk(self, lines):
+        """
+        Parses an iterable of lines, returns a tuple of the list of parsed
+        entries and the list of lines that could not be parsed.
+        """
+        parse = self.parse
+        entries = []
+        failures = []
+        for line in lines:
+            try:
+                entries.append(parse(line))
+            except PARSE_ERRORS:
+                failures.append(line)
+        return entries, failures
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Per-day consumption profiles: for each of the 1440 minutes of a local day,
+the average watts recorded in that minute and the number of MinuteData rows
+that were averaged (normally 1, but 2 for the repeated hour when DST ends).
+
+Averaging the profile of any set of days is then a NumPy reduction over the
+stacked vectors, rather than a GROUP BY over every minute of those days.
+
+The profiles of closed days are also cached, one entry per day (and per
+generation of the day, see joule.caching), so that any set of days can be
+assembled with a single get_many(), mostly from the in-process tier.
+"""
+
+from __future__ import unicode_literals, division
+
+import numpy as np
+
+from django.utils import timezone
+
+from joule.caching import (
+    day_scope,
+    get_generations,
+    tiered_cache,
+    versioned_key,
+)
+
+from .db import bulk_upsert
+from .models import DayProfile, MinuteData
+from .utils import get_rollup_timezone
+
+
+MINUTES_PER_DAY = 1440
+WATTS_DTYPE = np.dtype('<f8')
+SAMPLES_DTYPE = np.dtype('<u2')
+
+
+def pack(array, dtype):
+    return array.astype(dtype).tobytes()
+
+
+def unpack(value, dtype):
+    return np.frombuffer(bytes(value), dtype=dtype)
+
+
+def build_profiles(dates):
+    """
+    Computes the (watts, samples) vectors of the local days «dates» from
+    MinuteData, with a single query on its (local_date, minute) index.
+    Returns a dict of {date: (watts, samples)}.
+    """
+    dates = list(dates)
+    totals = dict(
+        (date, np.zeros(MINUTES_PER_DAY, dtype=WATTS_DTYPE)) for date in dates)
+    samples = dict(
+        (date, np.zeros(MINUTES_PER_DAY, dtype=SAMPLES_DTYPE))
+        for date in dates)
+    if dates:
+        rows = MinuteData.objects.filter(local_date__in=dates).values_list(
+            'local_date', 'minute', 'watts')
+        for date, minute, watts in rows.iterator():
+            totals[date][minute] += float(watts)
+            samples[date][minute] += 1
+
+    result = dict()
+    for date in dates:
+        watts = np.zeros(MINUTES_PER_DAY, dtype=WATTS_DTYPE)
+        recorded = samples[date] > 0
+        watts[recorded] = totals[date][recorded] / samples[date][recorded]
+        result[date] = (watts, samples[date])
+    return result
+
+
+def build_profile(date):
+    """
+    Computes the (watts, samples) vectors of the local day «date» from
+    MinuteData.
+    """
+    return build_profiles([date])[date]
+
+
+def save_profile(date, watts, samples):
+    bulk_upsert(
+        DayProfile, ('date', 'watts', 'samples'),
+        [(date, pack(watts, WATTS_DTYPE), pack(samples, SAMPLES_DTYPE))],
+        update_fields=('watts', 'samples'), conflict_fields=('date', ))
+
+
+def profile_cache_keys(dates):
+    """
+    Returns a dict of {date: cache key} for «dates».
+    """
+    generations = get_generations([day_scope(date) for date in dates])
+    return dict(
+        (date, versioned_key("joule:efergy:profile:" + date.isoformat(),
+                             [day_scope(date)], generations))
+        for date in dates)
+
+
+def cache_profiles(profiles):
+    """
+    Caches a dict of {date: (watts, samples)}, one entry per day.
+    """
+    if profiles:
+        keys = profile_cache_keys(list(profiles))
+        tiered_cache.set_many(dict(
+            (keys[date],
+             (pack(watts, WATTS_DTYPE), pack(samples, SAMPLES_DTYPE)))
+            for date, (watts, samples) in profiles.items()))
+
+
+def get_cached_profiles(dates):
+    """
+    Returns a dict of {date: (watts, samples)} for those of «dates» that are
+    cached, with a single get_many().
+    """
+    keys = dict((key, date)
+                for date, key in profile_cache_keys(list(dates)).items())
+    if not keys:
+        return dict()
+    cached = tiered_cache.get_many(list(keys))
+    return dict(
+        (keys[key],
+         (unpack(watts, WATTS_DTYPE), unpack(samples, SAMPLES_DTYPE)))
+        for key, (watts, samples) in cached.items())
+
+
+def load_profiles(dates):
+    """
+    Returns a dict of {date: (watts, samples)} for those of «dates» that
+    have a stored DayProfile.
+    """
+    rows = DayProfile.objects.filter(date__in=list(dates)).values_list(
+        'date', 'watts', 'samples')
+    return dict(
+        (date, (unpack(watts, WATTS_DTYPE), unpack(samples, SAMPLES_DTYPE)))
+        for date, watts, samples in rows)
+
+
+def get_profile_map(dates, tz=None):
+    """
+    Returns a dict of {date: (watts, samples)} for «dates». Closed days come
+    from the cache where possible, then from the stored profiles (caching
+    them). Days that aren't closed yet (or haven't been profiled) are
+    computed from MinuteData.
+    """
+    tz = tz or get_rollup_timezone()
+    dates = set(dates)
+    today = timezone.now().astimezone(tz).date()
+    closed = [date for date in dates if date < today]
+
+    profiles = get_cached_profiles(closed)
+    stored = load_profiles(date for date in closed if date not in profiles)
+    profiles.update(stored)
+    built = build_profiles(date for date in dates if date not in profiles)
+    profiles.update(built)
+
+    stored.update((date, profile) for date, profile in built.items()
+                  if date < today)
+    cache_profiles(stored)
+    return profiles
+
+
+def get_profiles(dates, tz=None):
+    """
+    Returns a list of (watts, samples) for «dates». See get_profile_map().
+    """
+    profiles = get_profile_map(dates, tz)
+    return [profiles[date] for date in dates]
+
+
+def hourly_watt_minutes(profiles):
+    """
+    Reduces a list of (watts, samples) profiles into 24 floats: for each hour,
+    the sum over its minutes of the minute's average watts across all the
+    profiles, i.e. the average watt-minutes consumed in that hour.
+    """
+    if not profiles:
+        return [0] * 24
+    watts = np.vstack([profile[0] for profile in profiles])
+    samples = np.vstack([profile[1] for profile in profiles]).astype(
+        WATTS_DTYPE)
+    totals = (watts * samples).sum(axis=0)
+    counts = samples.sum(axis=0)
+    averages = np.zeros(MINUTES_PER_DAY, dtype=WATTS_DTYPE)
+    recorded = counts > 0
+    averages[recorded] = totals[recorded] / counts[recorded]
+    return averages.reshape(24, 60).sum(axis=1).tolist()
+
+
+def grouped_hourly_watt_minutes(groups, tz=None):
+    """
+    Returns a dict of {key: hourly_watt_minutes()} for a dict of {key: list
+    of dates}. The profiles of all the dates are loaded together, so any
+    number of groups (e.g. the past and trend days of each day type) costs
+    no more queries than one.
+    """
+    profiles = get_profile_map(
+        set(date for dates in groups.values() for date in dates), tz)
+    return dict(
+        (key, hourly_watt_minutes([profiles[date] for date in dates]))
+        for key, dates in groups.items())
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, division
+
+import gzip
+import os
+import time
+
+from datetime import timedelta
+
+import pytz
+
+from django.db import connection
+
+from . import coverage
+from .models import EfergyData, MinuteData
+from .utils import get_rollup_timezone, local_day_range
+
+
+# Used when the database can't tell us the average size of a row.
+DEFAULT_ROW_BYTES = 64
+
+
+def estimate_row_bytes():
+    """
+    Returns the average on-disk size of an EfergyData row, indexes included.
+    """
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT (`data_length` + `index_length`) / GREATEST(`table_rows`, 1)
+                FROM `information_schema`.`tables`
+                WHERE `table_schema` = DATABASE() AND `table_name` = %s""",
+                (EfergyData._meta.db_table, ))
+            row = cursor.fetchone()
+            if row and row[0]:
+                return float(row[0])
+    return DEFAULT_ROW_BYTES
+
+
+class RetentionPolicy(object):
+    """
+    Removes raw EfergyData older than «max_age», one local day at a time.
+
+    A day is only touched if every minute that has raw samples also has its
+    MinuteData. Its samples are then exported to a gzipped CSV file in
+    «archive_dir», and finally deleted by primary key in batches of
+    «batch_size», pausing «pause» seconds in between, so that the table is
+    never locked for long. The raw coverage index of the day is then
+    recounted.
+
+    Each export goes to a new file, so that the samples archived by an
+    earlier (maybe interrupted) run of the same day are never overwritten.
+    """
+    def __init__(self, max_age, archive_dir, batch_size=1000, pause=0.1,
+                 tz=None):
+        self.max_age = max_age
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.pause = pause
+        self.tz = tz or get_rollup_timezone()
+
+    def expired_dates(self, now):
+        """
+        Returns the local dates, oldest first, whose raw data is entirely
+        older than «max_age».
+        """
+        first = EfergyData.objects.order_by('timestamp').first()
+        if first is None:
+            return []
+        first_date = first.timestamp.astimezone(self.tz).date()
+        # The last day that ends before the cut-off
+        last_date = (now - self.max_age).astimezone(self.tz).date() - \
+            timedelta(days=1)
+        return [first_date + timedelta(days=offset)
+                for offset in range((last_date - first_date).days + 1)]
+
+    def samples(self, date):
+        start, end = local_day_range(date, self.tz)
+        return EfergyData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).order_by('timestamp').values_list('id', 'timestamp', 'watts')
+
+    def missing_minutes(self, date):
+        """
+        Returns the sorted list of minutes of «date» that have raw samples
+        but no MinuteData.
+        """
+        start, end = local_day_range(date, self.tz)
+        raw_minutes = set(
+            timestamp.replace(second=0, microsecond=0)
+            for pk, timestamp, watts in self.samples(date).iterator())
+        minutes = set(MinuteData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).values_list('timestamp', flat=True))
+        return sorted(raw_minutes - minutes)
+
+    def archive_name(self, date):
+        """
+        Returns the first of efergy-<date>.csv.gz, efergy-<date>.1.csv.gz,
+        etc. that doesn't exist yet.
+        """
+        base_name = os.path.join(
+            self.archive_dir, 'efergy-{0}'.format(date.isoformat()))
+        file_name = base_name + '.csv.gz'
+        suffix = 0
+        while os.path.exists(file_name):
+            suffix += 1
+            file_name = '{0}.{1}.csv.gz'.format(base_name, suffix)
+        return file_name
+
+    def export(self, date):
+        """
+        Writes the samples of «date» to a new archive file, returns the list
+        of the exported primary keys.
+        """
+        if not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+        file_name = self.archive_name(date)
+        temp_name = file_name + '.tmp'
+        exported = []
+        with gzip.open(temp_name, 'wb') as archive:
+            archive.write(b'timestamp,watts\n')
+            for pk, timestamp, watts in self.samples(date).iterator():
+                archive.write('{0},{1}\n'.format(
+                    timestamp.astimezone(pytz.utc).isoformat(),
+                    watts).encode('ascii'))
+                exported.append(pk)
+        os.rename(temp_name, file_name)
+        return exported
+
+    def delete(self, pks):
+        """
+        Deletes «pks» in ascending batches of «batch_size».
+        """
+        pks = sorted(pks)
+        deleted = 0
+        for start in range(0, len(pks), self.batch_size):
+            batch = pks[start:start + self.batch_size]
+            EfergyData.objects.filter(pk__in=batch).delete()
+            deleted += len(batch)
+            if self.pause:
+                time.sleep(self.pause)
+        return deleted
+
+    def prune(self, date, dry_run=False):
+        """
+        Applies the policy to one local day. Returns (rows, missing_minutes),
+        where «rows» is the number of rows deleted (or, with «dry_run», that
+        would be).
+        """
+        missing = self.missing_minutes(date)
+        if missing:
+            return 0, missing
+        if dry_run:
+            return self.samples(date).count(), missing
+        if not self.samples(date).exists():
+            return 0, missing
+        rows = self.delete(self.export(date))
+        coverage.refresh(coverage.RAW, *local_day_range(date, self.tz))
+        return rows, missing
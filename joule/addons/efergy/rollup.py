@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+import threading
+import uuid
+
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from joule.addons.wunderground.models import WeatherData
+from joule.caching import bump_dates
+from joule.daytypes import get_day_type
+from joule.models import MonthSnapshot
+from joule.utils import safe_cache_key
+
+from . import coverage, profiles
+from .db import bulk_upsert
+from .models import DayData, EfergyData, MinuteData, Watermark
+from .utils import get_rollup_timezone, local_day_range
+
+
+# MySQL's AVG() of a DECIMAL(12,6) has 4 more decimal places, which
+# create_from_raw_mysql() then TRUNCATE()s to 6.
+AVG_PRECISION = Decimal('0.0000000001')
+WATTS_PRECISION = Decimal('0.000001')
+
+
+def average_watts(total, count):
+    return (total / count).quantize(
+        AVG_PRECISION, rounding=ROUND_HALF_UP).quantize(
+        WATTS_PRECISION, rounding=ROUND_DOWN)
+
+
+def iter_samples(start, end, window=timedelta(hours=6)):
+    """
+    Yields the (timestamp, watts) of every EfergyData in [start, end), in
+    time order. The range is read one «window» at a time, so memory use is
+    bounded however large the range is.
+    """
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window, end)
+        samples = EfergyData.objects.filter(
+            timestamp__gte=window_start, timestamp__lt=window_end,
+        ).order_by('timestamp').values_list('timestamp', 'watts')
+        for sample in samples.iterator():
+            yield sample
+        window_start = window_end
+
+
+def insert_minutes(rows):
+    """
+    Inserts the MinuteData «rows», tuples of MinuteRollup.fields, leaving
+    the minutes already stored alone. Returns (inserted, dates): the number
+    of minutes inserted and the set of their local dates.
+    """
+    if not rows:
+        return 0, set()
+    timestamps = [row[0] for row in rows]
+    stored = set(MinuteData.objects.filter(
+        timestamp__range=(min(timestamps), max(timestamps)),
+    ).values_list('timestamp', flat=True))
+    fresh = [row for row in rows if row[0] not in stored]
+    with transaction.atomic():
+        inserted = bulk_upsert(MinuteData, MinuteRollup.fields, fresh)
+    return inserted, set(row[3] for row in fresh)
+
+
+class MinuteRollup(object):
+    """
+    Averages raw EfergyData into MinuteData.
+
+    The portable path streams the samples in time order and averages them
+    into minute buckets in Python, which works on any database. On MySQL the
+    original INSERT ... SELECT is used instead, unless JOULE_ROLLUP_FAST_PATH
+    is False, followed by MinuteData.fill_local_dates() for the local date
+    and day type columns. Both paths process [watermark, now - lag) rounded
+    to the minute, and leave already stored minutes alone. The lag gives the
+    samples of a minute time to get out of the writer's buffer before the
+    minute is rolled up.
+
+    The watermark only advances past the minutes that had samples. Raw data
+    stored behind it (replayed spools, backfills, backlogs) calls rewind(),
+    which makes the next run start from there instead.
+    """
+    fields = ('timestamp', 'minute', 'watts', 'local_date', 'day_type')
+
+    watermark_name = 'efergy.minutedata'
+    rewind_name = 'efergy.minutedata.rewind'
+    lag = timedelta(minutes=2)
+    lock_key = 'joule:efergy:rollup:lock'
+    # Seconds after which a lock is considered abandoned by a dead process.
+    # A live process renews it every third of that.
+    lock_timeout = 600
+
+    def __init__(self, tz=None, batch_size=1000):
+        self.tz = tz or get_rollup_timezone()
+        self.batch_size = batch_size
+
+    def use_fast_path(self):
+        return (connection.vendor == 'mysql' and
+                getattr(settings, 'JOULE_ROLLUP_FAST_PATH', True))
+
+    def get_start(self):
+        start = Watermark.get(self.watermark_name)
+        if start is not None:
+            return start
+        latest_minute = MinuteData.objects.order_by('-timestamp').first()
+        if latest_minute is not None:
+            return latest_minute.timestamp + timedelta(minutes=1)
+        first_sample = EfergyData.objects.order_by('timestamp').first()
+        if first_sample is not None:
+            return first_sample.timestamp.replace(second=0, microsecond=0)
+        return pytz.utc.localize(datetime(2000, 1, 1, 0, 0, 0))
+
+    def get_end(self):
+        return (timezone.now() - self.lag).replace(second=0, microsecond=0)
+
+    @classmethod
+    def rewind(cls, timestamp):
+        """
+        Makes the next run start from the minute of «timestamp» at the latest,
+        because raw data was just stored there.
+        """
+        Watermark.lower(
+            cls.rewind_name, timestamp.replace(second=0, microsecond=0))
+
+    def get_latest_sample(self, start, end):
+        return EfergyData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).aggregate(latest=Max('timestamp'))['latest']
+
+    def buckets(self, start, end):
+        """
+        Yields (timestamp, minute, watts, local_date, day_type) for every
+        minute in [start, end) with at least one sample, in time order.
+        """
+        bucket = None
+        total = Decimal(0)
+        count = 0
+        for timestamp, watts in iter_samples(start, end):
+            timestamp = timestamp.astimezone(pytz.utc).replace(
+                second=0, microsecond=0)
+            if timestamp != bucket:
+                if count:
+                    yield self.make_row(bucket, total, count)
+                bucket = timestamp
+                total = Decimal(0)
+                count = 0
+            total += watts
+            count += 1
+        if count:
+            yield self.make_row(bucket, total, count)
+
+    def make_row(self, bucket, total, count):
+        local = bucket.astimezone(self.tz)
+        return (bucket, local.hour * 60 + local.minute,
+                average_watts(total, count), local.date(),
+                get_day_type(local.date()))
+
+    def rollup(self, start, end):
+        """
+        Creates MinuteData for [start, end) with the portable path. Returns
+        (created, dates): the number of minutes created and the set of their
+        local dates.
+        """
+        created = 0
+        dates = set()
+        rows = []
+        for row in self.buckets(start, end):
+            rows.append(row)
+            if len(rows) >= self.batch_size:
+                inserted, inserted_dates = insert_minutes(rows)
+                created += inserted
+                dates.update(inserted_dates)
+                rows = []
+        inserted, inserted_dates = insert_minutes(rows)
+        return created + inserted, dates | inserted_dates
+
+    def run(self, fast_path=None, end=None):
+        """
+        Rolls up everything since the watermark (or since the earliest
+        rewind()), then advances the watermark past the last minute that had
+        samples. Returns the number of minutes created.
+        """
+        if fast_path is None:
+            fast_path = self.use_fast_path()
+        watermark = self.get_start()
+        end = end or self.get_end()
+        rewind = Watermark.pop(self.rewind_name)
+        start = min(watermark, rewind) if rewind is not None else watermark
+        if start >= end:
+            if rewind is not None:
+                Watermark.lower(self.rewind_name, rewind)
+            return 0
+        try:
+            latest = self.get_latest_sample(start, end)
+            if fast_path:
+                created = MinuteData.create_from_raw_mysql(start, end)
+                # The new minutes are the ones without a local date yet.
+                dates = MinuteData.fill_local_dates(start, end, self.tz)
+            else:
+                created, dates = self.rollup(start, end)
+            if created:
+                coverage.refresh(coverage.MINUTE, start, end)
+                SummaryRollup(self.tz).update_days(sorted(dates))
+        except Exception:
+            # Don't lose track of the rewound data.
+            if rewind is not None:
+                Watermark.lower(self.rewind_name, rewind)
+            raise
+        if latest is not None:
+            Watermark.set(self.watermark_name, max(
+                watermark,
+                latest.replace(second=0, microsecond=0) +
+                timedelta(minutes=1)))
+        return created
+
+    def run_exclusive(self, fast_path=None, end=None):
+        """
+        Like run(), but only if no other process is running the rollup, in
+        which case it returns None at once. The lock is a cache key holding a
+        token unique to this run. It is added atomically, renewed while the
+        run goes on however long it takes, and only removed if it still
+        holds our token.
+        """
+        lock_key = safe_cache_key(self.lock_key)
+        token = uuid.uuid4().hex
+        if not cache.add(lock_key, token, self.lock_timeout):
+            return None
+        done = threading.Event()
+        renewer = threading.Thread(
+            target=self.renew_lock, args=(lock_key, token, done))
+        renewer.daemon = True
+        renewer.start()
+        try:
+            return self.run(fast_path=fast_path, end=end)
+        finally:
+            done.set()
+            renewer.join()
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    def renew_lock(self, lock_key, token, done):
+        """
+        Extends the lock every third of «lock_timeout» until «done» is set,
+        unless it expired and was taken by another process meanwhile.
+        """
+        while not done.wait(self.lock_timeout / 3.0):
+            if cache.get(lock_key) != token:
+                return
+            cache.set(lock_key, token, self.lock_timeout)
+
+    def verify(self, start, end):
+        """
+        Compares the (minute, watts) rows the two paths produce for
+        [start, end) without writing anything. Returns a list of
+        (python_row, mysql_row) pairs that differ.
+        """
+        python_rows = [row[1:3] for row in self.buckets(start, end)]
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT
+                HOUR(CONVERT_TZ(`timestamp`, '+00:00', @@global.time_zone)) * 60 + MINUTE(CONVERT_TZ(`timestamp`, '+00:00', @@global.time_zone)),
+                TRUNCATE(AVG(`watts`), 6)
+            FROM `efergy_efergydata`
+            WHERE `timestamp` >= %s AND `timestamp` < %s
+            GROUP BY FLOOR(UNIX_TIMESTAMP(`timestamp`)/60)
+            ORDER BY FLOOR(UNIX_TIMESTAMP(`timestamp`)/60)""",
+            (start, end))
+        mysql_rows = [(int(minute), Decimal(watts))
+                      for minute, watts in cursor.fetchall()]
+        differences = []
+        for index in range(max(len(python_rows), len(mysql_rows))):
+            python_row = python_rows[index] if index < len(python_rows) else None
+            mysql_row = mysql_rows[index] if index < len(mysql_rows) else None
+            if python_row != mysql_row:
+                differences.append((python_row, mysql_row))
+        return differences
+
+
+class Summary(object):
+    """
+    Accumulates minute watts into the figures stored in DayData.
+    """
+    def __init__(self):
+        self.total = Decimal(0)
+        self.min_watts = None
+        self.max_watts = None
+        self.samples = 0
+
+    def add(self, watts):
+        self.total += watts
+        self.samples += 1
+        if self.min_watts is None or watts < self.min_watts:
+            self.min_watts = watts
+        if self.max_watts is None or watts > self.max_watts:
+            self.max_watts = watts
+
+    def values(self):
+        """
+        Returns (energy, min_watts, max_watts, avg_watts, samples).
+        """
+        return (
+            (self.total / 60000).quantize(WATTS_PRECISION),
+            self.min_watts,
+            self.max_watts,
+            (self.total / self.samples).quantize(WATTS_PRECISION),
+            self.samples,
+        )
+
+
+class SummaryRollup(object):
+    """
+    Keeps DayData up to date by re-summarising each local day touched by
+    newly created MinuteData, and stores the DayProfile of each such day that
+    has closed. The MonthSnapshots of the months touched are discarded, as
+    their bill estimates have changed, and the cache generations of the days
+    and months touched are bumped.
+    """
+    day_fields = ('date', 'energy', 'min_watts', 'max_watts', 'avg_watts',
+                  'samples', 'high', 'low')
+
+    def __init__(self, tz=None):
+        self.tz = tz or get_rollup_timezone()
+
+    def summarize(self, date):
+        """
+        Returns the DayData row for the local day «date» as a tuple of
+        day_fields, or None if it has no MinuteData.
+        """
+        start, end = local_day_range(date, self.tz)
+        minutes = MinuteData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).values_list('watts', flat=True)
+
+        day = Summary()
+        for watts in minutes.iterator():
+            day.add(watts)
+
+        if not day.samples:
+            return None
+
+        temps = WeatherData.objects.filter(
+            timestamp__gte=start, timestamp__lt=end,
+        ).aggregate(high=Max('outside_temp'), low=Min('outside_temp'))
+        return (date, ) + day.values() + (temps['high'], temps['low'])
+
+    def update_day(self, date):
+        day_row = self.summarize(date)
+        if day_row is None:
+            return
+        if date < timezone.now().astimezone(self.tz).date():
+            # The day is closed, so its profile won't change any more.
+            profiles.save_profile(date, *profiles.build_profile(date))
+        bulk_upsert(DayData, self.day_fields, [day_row],
+                    update_fields=self.day_fields[1:],
+                    conflict_fields=('date', ))
+
+    def update_days(self, dates):
+        """
+        Re-summarises the local «dates», then invalidates what was computed
+        from them.
+        """
+        for date in dates:
+            self.update_day(date)
+        MonthSnapshot.invalidate(dates)
+        bump_dates(dates)
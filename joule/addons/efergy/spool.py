@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import calendar
+import os
+import re
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+
+SEGMENT_RE = re.compile(r'^segment-(\d{10})\.log$')
+
+
+def format_entry(entry):
+    timestamp = entry['timestamp']
+    return "{0}.{1:06d},{2}\n".format(
+        calendar.timegm(timestamp.utctimetuple()), timestamp.microsecond,
+        entry['watts'])
+
+
+def parse_entry(line):
+    seconds, watts = line.split(',')
+    seconds, microseconds = seconds.split('.')
+    timestamp = datetime.utcfromtimestamp(int(seconds)).replace(
+        microsecond=int(microseconds), tzinfo=timezone.utc)
+    return {'timestamp': timestamp, 'watts': Decimal(watts)}
+
+
+class Spool(object):
+    """
+    A write-ahead log of parsed EfergyData entries, kept as a directory of
+    numbered segment files.
+
+    Entries are appended to the active segment before they are buffered for
+    the database. When a batch is about to be written, seal() fsyncs and
+    closes the active segment, and once the batch is committed ack() deletes
+    it. Any segment still on disk is therefore unacknowledged, and is
+    replayed on the next start.
+
+    Syncing once per batch rather than once per entry keeps fsync latency
+    from limiting the ingest rate. The entries of the batch being buffered
+    are only in the OS's cache until then, so they survive the process
+    dying, but not a power cut.
+
+    Entries the database refuses are set aside with quarantine() in
+    quarantine.log, which is never replayed.
+    """
+    quarantine_name = 'quarantine.log'
+
+    def __init__(self, directory, fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._active = None
+        self._active_name = None
+        self._seq = max([seq for seq, name in self._segments()] or [0]) + 1
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_RE.match(name)
+            if match:
+                segments.append((int(match.group(1)), name))
+        return sorted(segments)
+
+    def pending(self):
+        """
+        Returns the paths of all sealed, unacknowledged segments, oldest
+        first.
+        """
+        return [os.path.join(self.directory, name)
+                for seq, name in self._segments()
+                if os.path.join(self.directory, name) != self._active_name]
+
+    def append(self, entry):
+        if self._active is None:
+            self._active_name = os.path.join(
+                self.directory, 'segment-{0:010d}.log'.format(self._seq))
+            self._seq += 1
+            self._active = open(self._active_name, 'a')
+        self._active.write(format_entry(entry))
+        self._active.flush()
+
+    def seal(self):
+        """
+        Closes the active segment and returns its path, or None if nothing was
+        appended since the last seal().
+        """
+        if self._active is None:
+            return None
+        if self.fsync:
+            os.fsync(self._active.fileno())
+        self._active.close()
+        segment = self._active_name
+        self._active = None
+        self._active_name = None
+        return segment
+
+    def ack(self, segment):
+        try:
+            os.remove(segment)
+        except OSError:
+            pass
+
+    def quarantine(self, entry):
+        path = os.path.join(self.directory, self.quarantine_name)
+        with open(path, 'a') as quarantine_file:
+            quarantine_file.write(format_entry(entry))
+
+    def read(self, segment):
+        """
+        Yields the entries in «segment». A torn, final line left by a crash
+        mid-write is skipped.
+        """
+        with open(segment) as segment_file:
+            for line in segment_file:
+                try:
+                    yield parse_entry(line)
+                except (ValueError, InvalidOperation):
+                    continue
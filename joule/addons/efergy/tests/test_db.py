@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..db import bulk_upsert
+from ..models import CoverageBucket, DayData
+
+
+DAY_FIELDS = ('date', 'energy', 'min_watts', 'max_watts', 'avg_watts',
+              'samples')
+
+HOUR = pytz.utc.localize(datetime(2015, 9, 1, 12))
+
+
+def day_row(day, energy):
+    return (date(2015, 9, day), Decimal(energy), Decimal(1), Decimal(2),
+            Decimal("1.5"), 1440)
+
+
+class BulkUpsertTests(TestCase):
+
+    def energies(self):
+        return dict(DayData.objects.values_list('date', 'energy'))
+
+    def test_inserts(self):
+        self.assertEqual(bulk_upsert(
+            DayData, DAY_FIELDS, [day_row(1, "1.5"), day_row(2, "2.5")]), 2)
+        self.assertEqual(self.energies(), {
+            date(2015, 9, 1): Decimal("1.5"), date(2015, 9, 2): Decimal("2.5")})
+
+    def test_nothing_to_insert(self):
+        self.assertEqual(bulk_upsert(DayData, DAY_FIELDS, []), 0)
+
+    def test_leaves_stored_rows_alone(self):
+        bulk_upsert(DayData, DAY_FIELDS, [day_row(1, "1.5")])
+        bulk_upsert(DayData, DAY_FIELDS,
+                    [day_row(1, "9.5"), day_row(2, "2.5")])
+        self.assertEqual(self.energies(), {
+            date(2015, 9, 1): Decimal("1.5"), date(2015, 9, 2): Decimal("2.5")})
+
+    def test_counts_only_inserted_rows(self):
+        rows = [day_row(1, "1.5"), day_row(2, "2.5")]
+        bulk_upsert(DayData, DAY_FIELDS, rows)
+        self.assertEqual(bulk_upsert(DayData, DAY_FIELDS, rows), 0)
+        self.assertEqual(bulk_upsert(
+            DayData, DAY_FIELDS, rows + [day_row(3, "3.5")]), 1)
+
+    def test_updates_stored_rows(self):
+        bulk_upsert(DayData, DAY_FIELDS, [day_row(1, "1.5")])
+        bulk_upsert(DayData, DAY_FIELDS,
+                    [day_row(1, "9.5"), day_row(2, "2.5")],
+                    update_fields=('energy', ), conflict_fields=('date', ))
+        self.assertEqual(self.energies(), {
+            date(2015, 9, 1): Decimal("9.5"), date(2015, 9, 2): Decimal("2.5")})
+
+    def test_increments_stored_rows(self):
+        fields = ('kind', 'hour', 'count')
+        for count in (10, 5):
+            bulk_upsert(CoverageBucket, fields,
+                        [(CoverageBucket.RAW, HOUR, count)],
+                        increment_fields=('count', ),
+                        conflict_fields=('kind', 'hour'))
+        self.assertEqual(CoverageBucket.objects.get().count, 15)
+
+    def test_batches(self):
+        rows = [day_row(day, day) for day in range(1, 31)]
+        self.assertEqual(
+            bulk_upsert(DayData, DAY_FIELDS, rows, batch_size=7), 30)
+        self.assertEqual(DayData.objects.count(), 30)
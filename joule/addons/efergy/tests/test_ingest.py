@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..ingest import BufferedWriter, DedupWindow
+from ..models import EfergyData
+
+
+START = pytz.utc.localize(datetime(2015, 9, 1))
+
+
+def entry(seconds, watts="100.5"):
+    return {"timestamp": START + timedelta(seconds=seconds),
+            "watts": Decimal(watts)}
+
+
+class DedupWindowTests(TestCase):
+
+    def test_drops_repeats(self):
+        window = DedupWindow()
+        self.assertFalse(window.seen(entry(0)))
+        self.assertFalse(window.seen(entry(10)))
+        self.assertFalse(window.seen(entry(0, "100.6")))
+        self.assertTrue(window.seen(entry(0)))
+        self.assertEqual((window.hits, window.misses), (1, 3))
+
+    def test_rounds_like_the_watts_column(self):
+        window = DedupWindow()
+        window.seen(entry(0, "100.5"))
+        self.assertTrue(window.seen(entry(0, "100.5000001")))
+
+    def test_forgets_beyond_span(self):
+        window = DedupWindow(span=timedelta(hours=1))
+        window.seen(entry(0))
+        window.seen(entry(3601))
+        self.assertEqual(len(window), 1)
+        self.assertFalse(window.seen(entry(0)))
+
+    def test_forgets_oldest_beyond_max_size(self):
+        window = DedupWindow(max_size=3)
+        for seconds in range(0, 50, 10):
+            window.seen(entry(seconds))
+        self.assertEqual(len(window), 3)
+        self.assertFalse(window.seen(entry(0)))
+        self.assertTrue(window.seen(entry(40)))
+
+    def test_seed(self):
+        for seconds in (0, 10, 20):
+            EfergyData.objects.create(**entry(seconds))
+        window = DedupWindow(span=timedelta(seconds=15))
+        self.assertEqual(window.seed(), 2)
+        self.assertTrue(window.seen(entry(20)))
+        self.assertFalse(window.seen(entry(0)))
+
+    def test_writer_skips_known_duplicates(self):
+        writer = BufferedWriter(dedup=DedupWindow())
+        writer.extend([entry(0), entry(10), entry(0)])
+        writer.flush()
+        self.assertEqual(writer.stats.duplicates, 1)
+        self.assertEqual(writer.stats.inserted, 2)
+        self.assertEqual(EfergyData.objects.count(), 2)
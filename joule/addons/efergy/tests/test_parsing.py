@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from ..parsing import PARSE_ERRORS, FastLineParser, parse_line
+
+
+TZ = pytz.timezone("America/New_York")
+# Until 2019, DST started and ended at midnight in Sao Paulo.
+MIDNIGHT_DST_TZ = pytz.timezone("America/Sao_Paulo")
+
+
+def make_lines(start, count, step=timedelta(seconds=10)):
+    return ["{0},{1}.5\n".format(
+        (start + step * n).strftime("%m/%d/%y,%H:%M:%S"), 100 + n)
+        for n in range(count)]
+
+
+class FastLineParserTests(SimpleTestCase):
+
+    def setUp(self):
+        self.parser = FastLineParser(TZ)
+
+    def parse_slowly(self, lines, tz=TZ):
+        entries = []
+        failures = []
+        with timezone.override(tz):
+            for line in lines:
+                try:
+                    entries.append(parse_line(line))
+                except PARSE_ERRORS:
+                    failures.append(line)
+        return entries, failures
+
+    def test_same_as_parse_line(self):
+        lines = make_lines(datetime(2015, 9, 1, 23, 58), 30)
+        self.assertEqual(self.parser.parse_chunk(lines),
+                         self.parse_slowly(lines))
+
+    def test_parses_fields(self):
+        entry = self.parser.parse("09/01/15,13:45:10,1234.500000\n")
+        self.assertEqual(
+            entry["timestamp"], TZ.localize(datetime(2015, 9, 1, 13, 45, 10)))
+        self.assertEqual(entry["watts"], Decimal("1234.5"))
+
+    def test_fall_back_day(self):
+        # The 1am hour happens twice on 11/01/15, so it can't be parsed.
+        lines = make_lines(datetime(2015, 11, 1, 0, 30), 500, timedelta(
+            seconds=30))
+        entries, failures = self.parser.parse_chunk(lines)
+        self.assertEqual((entries, failures), self.parse_slowly(lines))
+        self.assertEqual(len(failures), 120)
+        self.assertTrue(all(",01:" in line for line in failures))
+
+    def test_spring_forward_day(self):
+        # The 2am hour doesn't exist on 03/08/15.
+        lines = make_lines(datetime(2015, 3, 8, 1, 30), 500, timedelta(
+            seconds=30))
+        entries, failures = self.parser.parse_chunk(lines)
+        self.assertEqual((entries, failures), self.parse_slowly(lines))
+        self.assertEqual(len(failures), 120)
+        self.assertTrue(all(",02:" in line for line in failures))
+
+    def test_bad_lines_are_failures(self):
+        lines = [
+            "13/01/15,00:00:00,1.0\n",
+            "09/01/15,25:00:00,1.0\n",
+            "09/01/15,00:00:00,watts\n",
+            "9/1/15,00:00:00,1.0\n",
+            "09/01/15,00:00:00,1.0\n",
+        ]
+        entries, failures = self.parser.parse_chunk(lines)
+        self.assertEqual((entries, failures), self.parse_slowly(lines))
+        self.assertEqual(len(entries), 2)
+
+    def test_midnight_spring_forward_day(self):
+        # The midnight hour doesn't exist on 10/18/15 in Sao Paulo.
+        parser = FastLineParser(MIDNIGHT_DST_TZ)
+        lines = make_lines(datetime(2015, 10, 17, 23, 30), 300, timedelta(
+            seconds=30))
+        entries, failures = parser.parse_chunk(lines)
+        self.assertEqual((entries, failures),
+                         self.parse_slowly(lines, MIDNIGHT_DST_TZ))
+        self.assertEqual(len(failures), 120)
+        self.assertTrue(all("10/18/15,00:" in line for line in failures))
+
+    def test_slow_path_uses_own_timezone(self):
+        with timezone.override(pytz.utc):
+            entry = self.parser.parse("9/1/15,13:45:10,1.5\n")
+        self.assertEqual(
+            entry["timestamp"], TZ.localize(datetime(2015, 9, 1, 13, 45, 10)))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+import random
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db.models import Avg
+from django.test import TestCase, override_settings
+
+from joule.caching import tiered_cache
+from joule.daytypes import get_day_type
+
+from .. import profiles
+from ..models import DayProfile, MinuteData
+
+
+TZ = pytz.timezone("America/New_York")
+
+DATES = [date(2015, 10, 31), date(2015, 11, 1), date(2015, 11, 2)]
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+def store_minutes(day, step, seed):
+    """
+    Stores a MinuteData every «step» minutes of the local «day», including
+    both 1:xx hours on the day DST ends.
+    """
+    rng = random.Random(seed)
+    timestamp = TZ.localize(datetime.combine(day, datetime.min.time()))
+    end = TZ.localize(datetime.combine(
+        day + timedelta(days=1), datetime.min.time()))
+    rows = []
+    while timestamp < end:
+        local = TZ.normalize(timestamp)
+        rows.append(MinuteData(
+            timestamp=timestamp, minute=local.hour * 60 + local.minute,
+            watts=Decimal(rng.randint(0, 900000)) / 100, local_date=day,
+            day_type=get_day_type(day)))
+        timestamp += timedelta(minutes=step)
+    MinuteData.objects.bulk_create(rows)
+
+
+def group_by_minute(dates):
+    """
+    The hourly watt-minutes of «dates» as the view used to compute them,
+    with AVG(watts) GROUP BY minute.
+    """
+    wm_hours = [0.0] * 24
+    rows = MinuteData.objects.filter(local_date__in=dates).values(
+        "minute").annotate(watts=Avg("watts")).order_by("minute")
+    for row in rows:
+        wm_hours[row["minute"] // 60] += float(row["watts"])
+    return wm_hours
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProfileTests(TestCase):
+
+    def setUp(self):
+        tiered_cache.local.clear()
+        for index, day in enumerate(DATES):
+            store_minutes(day, index + 1, index)
+
+    def assertSameHours(self, first, second):
+        self.assertEqual(len(first), 24)
+        for a, b in zip(first, second):
+            self.assertAlmostEqual(a, b, places=6)
+
+    def test_same_as_group_by(self):
+        for dates in ([DATES[0]], [DATES[1]], DATES):
+            self.assertSameHours(
+                profiles.hourly_watt_minutes(profiles.get_profiles(dates)),
+                group_by_minute(dates))
+
+    def test_counts_repeated_hour_twice(self):
+        watts, samples = profiles.build_profile(DATES[1])
+        self.assertEqual(samples[90], 2)
+        self.assertEqual(samples[3 * 60], 1)
+        self.assertEqual(samples[3 * 60 + 1], 0)
+
+    def test_stored_profiles_are_the_same(self):
+        built = profiles.build_profiles(DATES)
+        for day in DATES:
+            profiles.save_profile(day, *built[day])
+        MinuteData.objects.all().delete()
+
+        stored = profiles.load_profiles(DATES)
+        self.assertEqual(DayProfile.objects.count(), 3)
+        for day in DATES:
+            self.assertEqual(stored[day][0].tolist(), built[day][0].tolist())
+            self.assertEqual(stored[day][1].tolist(), built[day][1].tolist())
+
+    def test_grouped(self):
+        groups = {"a": DATES[:2], "b": DATES[1:], "none": []}
+        grouped = profiles.grouped_hourly_watt_minutes(groups, TZ)
+        for key, dates in groups.items():
+            self.assertSameHours(grouped[key], group_by_minute(dates))
+
+    def test_closed_days_come_from_cache(self):
+        first = profiles.get_profile_map(DATES, TZ)
+        MinuteData.objects.all().delete()
+        tiered_cache.local.clear()
+
+        cached = profiles.get_profile_map(DATES, TZ)
+        for day in DATES:
+            self.assertEqual(cached[day][0].tolist(), first[day][0].tolist())
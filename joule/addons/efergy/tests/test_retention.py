@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import gzip
+import os
+import pytz
+import shutil
+import tempfile
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+
+from .. import coverage
+from ..models import CoverageBucket, EfergyData, MinuteData
+from ..retention import RetentionPolicy
+
+
+TZ = pytz.timezone("America/New_York")
+
+DAY = date(2015, 9, 1)
+# Noon, local time
+NOON = TZ.localize(datetime(2015, 9, 1, 12))
+
+
+def store(start, count, step=timedelta(seconds=10)):
+    """
+    Stores «count» samples from «start», returns their primary keys.
+    """
+    return [EfergyData.objects.create(
+        timestamp=start + step * n, watts=Decimal(100 + n)).pk
+        for n in range(count)]
+
+
+def store_minutes(start, count):
+    for n in range(count):
+        timestamp = start + timedelta(minutes=n)
+        MinuteData.objects.create(
+            timestamp=timestamp, minute=timestamp.hour * 60 + timestamp.minute,
+            watts=Decimal(100))
+
+
+class RetentionPolicyTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.policy = RetentionPolicy(
+            timedelta(days=30), self.directory, batch_size=2, pause=0, tz=TZ)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def archives(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_refuses_days_with_missing_minutes(self):
+        store(NOON, 12)
+        store_minutes(NOON, 1)
+
+        rows, missing = self.policy.prune(DAY)
+
+        self.assertEqual((rows, missing), (0, [NOON + timedelta(minutes=1)]))
+        self.assertEqual(EfergyData.objects.count(), 12)
+        self.assertEqual(self.archives(), [])
+
+    def test_archives_and_deletes_the_day(self):
+        pks = store(NOON, 12)
+        # The next local day
+        kept = store(NOON + timedelta(hours=12), 6)
+        store_minutes(NOON, 2)
+
+        self.assertEqual(self.policy.prune(DAY), (12, []))
+
+        self.assertEqual(
+            sorted(EfergyData.objects.values_list("pk", flat=True)), kept)
+        archive, = self.archives()
+        with gzip.open(os.path.join(self.directory, archive)) as archive_file:
+            lines = archive_file.read().decode("ascii").splitlines()
+        self.assertEqual(lines[0], "timestamp,watts")
+        self.assertEqual(len(lines), len(pks) + 1)
+        self.assertEqual(
+            lines[1], "2015-09-01T16:00:00+00:00,100.000000")
+
+    def test_never_overwrites_an_archive(self):
+        first = self.policy.archive_name(DAY)
+        self.assertEqual(
+            os.path.basename(first), "efergy-2015-09-01.csv.gz")
+        open(first, "w").close()
+        second = self.policy.archive_name(DAY)
+        self.assertEqual(
+            os.path.basename(second), "efergy-2015-09-01.1.csv.gz")
+        open(second, "w").close()
+        self.assertEqual(os.path.basename(self.policy.archive_name(DAY)),
+                         "efergy-2015-09-01.2.csv.gz")
+
+    def test_prunes_late_samples_to_a_new_archive(self):
+        store(NOON, 6)
+        store_minutes(NOON, 1)
+        self.policy.prune(DAY)
+        store(NOON + timedelta(seconds=5), 1)
+
+        self.assertEqual(self.policy.prune(DAY), (1, []))
+
+        self.assertEqual(self.archives(), [
+            "efergy-2015-09-01.1.csv.gz", "efergy-2015-09-01.csv.gz"])
+
+    def test_deletes_exactly_the_given_rows(self):
+        pks = store(NOON, 7)
+
+        self.assertEqual(self.policy.delete(pks[1:6]), 5)
+
+        self.assertEqual(
+            sorted(EfergyData.objects.values_list("pk", flat=True)),
+            [pks[0], pks[6]])
+
+    def test_recounts_raw_coverage(self):
+        store(NOON, 12)
+        store(NOON + timedelta(hours=12), 6)
+        store_minutes(NOON, 2)
+        coverage.rebuild(coverage.RAW)
+
+        self.policy.prune(DAY)
+
+        self.assertEqual(
+            list(CoverageBucket.objects.filter(kind=coverage.RAW).values_list(
+                "hour", "count")),
+            [(coverage.hour_start(NOON + timedelta(hours=12)), 6)])
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytz
+import time
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.utils import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from joule.daytypes import WINTER
+from joule.utils import safe_cache_key
+
+from ..ingest import BufferedWriter
+from ..models import DayData, EfergyData, MinuteData, Watermark
+from ..rollup import MinuteRollup, SummaryRollup, insert_minutes
+
+
+TZ = pytz.timezone("America/New_York")
+
+# Noon, local time
+START = pytz.utc.localize(datetime(2015, 12, 1, 17))
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+def sample(seconds, watts=100):
+    return {"timestamp": START + timedelta(seconds=seconds),
+            "watts": Decimal(watts)}
+
+
+def store(*samples):
+    for entry in samples:
+        EfergyData.objects.create(**entry)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MinuteRollupTests(TestCase):
+
+    def setUp(self):
+        self.rollup = MinuteRollup(tz=TZ)
+
+    def run_until(self, minutes):
+        return self.rollup.run(
+            fast_path=False, end=START + timedelta(minutes=minutes))
+
+    def minutes(self):
+        return list(MinuteData.objects.order_by("timestamp").values_list(
+            "timestamp", flat=True))
+
+    def watermark(self):
+        return Watermark.get(MinuteRollup.watermark_name)
+
+    def test_averages_samples_into_minutes(self):
+        store(sample(0, 100), sample(10, 200), sample(20, 400),
+              sample(60, 50))
+
+        self.assertEqual(self.run_until(10), 2)
+
+        first, second = MinuteData.objects.order_by("timestamp")
+        self.assertEqual((first.timestamp, first.minute, first.watts),
+                         (START, 12 * 60, Decimal("233.333333")))
+        self.assertEqual((first.local_date, first.day_type),
+                         (date(2015, 12, 1), WINTER))
+        self.assertEqual(second.minute, 12 * 60 + 1)
+        self.assertEqual(DayData.objects.get().samples, 2)
+
+    def test_watermark_stops_after_last_sample(self):
+        store(sample(0))
+        self.run_until(10)
+        self.assertEqual(self.watermark(), START + timedelta(minutes=1))
+
+        # Stored late, but after the watermark
+        store(sample(5 * 60))
+        self.assertEqual(self.run_until(10), 1)
+        self.assertEqual(self.watermark(), START + timedelta(minutes=6))
+
+    def test_watermark_stays_without_samples(self):
+        store(sample(0))
+        self.run_until(10)
+        self.assertEqual(self.run_until(20), 0)
+        self.assertEqual(self.watermark(), START + timedelta(minutes=1))
+
+    def test_rewinds_for_samples_behind_watermark(self):
+        store(sample(5 * 60))
+        self.run_until(10)
+
+        writer = BufferedWriter()
+        writer.extend([sample(0), sample(70)])
+        writer.flush()
+        self.assertEqual(self.run_until(10), 2)
+
+        self.assertEqual(self.minutes(), [
+            START, START + timedelta(minutes=1), START + timedelta(minutes=5)])
+        self.assertEqual(self.watermark(), START + timedelta(minutes=6))
+        self.assertIsNone(Watermark.get(MinuteRollup.rewind_name))
+
+    def test_keeps_rewind_when_failing(self):
+        store(sample(5 * 60))
+        self.run_until(10)
+        writer = BufferedWriter()
+        writer.extend([sample(0)])
+        writer.flush()
+
+        with mock.patch.object(
+                self.rollup, "rollup", side_effect=DatabaseError("gone")):
+            self.assertRaises(DatabaseError, self.run_until, 10)
+        self.assertEqual(Watermark.get(MinuteRollup.rewind_name), START)
+
+        self.assertEqual(self.run_until(10), 1)
+        self.assertEqual(self.minutes()[0], START)
+
+    def test_summarizes_only_days_with_new_minutes(self):
+        later = 3 * 24 * 60
+        store(sample(0), sample(later * 60))
+        self.run_until(later + 10)
+
+        writer = BufferedWriter()
+        writer.extend([sample(70)])
+        writer.flush()
+        with mock.patch.object(SummaryRollup, "update_days") as update_days:
+            self.assertEqual(self.run_until(later + 10), 1)
+        update_days.assert_called_once_with([date(2015, 12, 1)])
+
+    def test_insert_minutes_skips_stored_minutes(self):
+        store(sample(0), sample(60))
+        rows = list(self.rollup.buckets(START, START + timedelta(minutes=10)))
+        dates = set([date(2015, 12, 1)])
+
+        self.assertEqual(insert_minutes(rows[:1]), (1, dates))
+        self.assertEqual(insert_minutes(rows), (1, dates))
+        self.assertEqual(insert_minutes(rows), (0, set()))
+
+    def test_stays_behind_now(self):
+        self.assertLessEqual(
+            self.rollup.get_end(), timezone.now() - MinuteRollup.lag)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RunExclusiveTests(TestCase):
+
+    def setUp(self):
+        self.rollup = MinuteRollup(tz=TZ)
+        self.lock_key = safe_cache_key(MinuteRollup.lock_key)
+        cache.delete(self.lock_key)
+
+    def test_skips_while_locked(self):
+        cache.add(self.lock_key, "other", 60)
+        with mock.patch.object(self.rollup, "run") as run:
+            self.assertIsNone(self.rollup.run_exclusive())
+        self.assertFalse(run.called)
+        self.assertEqual(cache.get(self.lock_key), "other")
+
+    def test_releases_lock(self):
+        with mock.patch.object(self.rollup, "run", return_value=3):
+            self.assertEqual(self.rollup.run_exclusive(), 3)
+        self.assertIsNone(cache.get(self.lock_key))
+
+    def test_renews_lock_during_long_runs(self):
+        self.rollup.lock_timeout = 0.3
+
+        def run(**kwargs):
+            time.sleep(0.6)
+            return cache.get(self.lock_key)
+
+        with mock.patch.object(self.rollup, "run", side_effect=run):
+            self.assertIsNotNone(self.rollup.run_exclusive())
+        self.assertIsNone(cache.get(self.lock_key))
+
+    def test_leaves_lock_taken_over_by_another_run(self):
+        def run(**kwargs):
+            # Our lock expired, and another process took it.
+            cache.set(self.lock_key, "other", 60)
+
+        with mock.patch.object(self.rollup, "run", side_effect=run):
+            self.rollup.run_exclusive()
+        self.assertEqual(cache.get(self.lock_key), "other")
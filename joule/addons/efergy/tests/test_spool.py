@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import os
+import pytz
+import shutil
+import tempfile
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db.utils import DataError, OperationalError
+from django.test import TestCase
+
+from ..ingest import BufferedWriter
+from ..models import EfergyData
+from ..spool import Spool
+
+
+def make_entries(count, start=datetime(2015, 9, 1)):
+    start = pytz.utc.localize(start)
+    return [{"timestamp": start + timedelta(seconds=10 * n),
+             "watts": Decimal("100.25") + n}
+            for n in range(count)]
+
+
+POISON = Decimal("666")
+
+
+def refuse_poison(bulk_create):
+    """
+    Wraps BufferedWriter._bulk_create() so that the database refuses the
+    POISON watts, like MySQL refuses an out of range value.
+    """
+    def _bulk_create(entries):
+        if any(entry["watts"] == POISON for entry in entries):
+            raise DataError("Out of range value for column 'watts'")
+        return bulk_create(entries)
+    return _bulk_create
+
+
+class SpoolReplayTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def crash(self, entries):
+        """
+        Spools «entries» without committing them, as if the process died
+        before the batch was written.
+        """
+        writer = BufferedWriter(
+            batch_size=1000, spool=Spool(self.directory, fsync=False))
+        writer.extend(entries)
+        return writer
+
+    def test_replays_unacknowledged_segments(self):
+        entries = make_entries(25)
+        self.crash(entries)
+        self.assertEqual(EfergyData.objects.count(), 0)
+
+        spool = Spool(self.directory, fsync=False)
+        writer = BufferedWriter(batch_size=10, spool=spool)
+        count, seconds = writer.recover()
+
+        self.assertEqual(count, 25)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(
+            list(EfergyData.objects.order_by("timestamp").values_list(
+                "timestamp", "watts")),
+            [(entry["timestamp"], entry["watts"]) for entry in entries])
+
+    def test_skips_torn_line(self):
+        self.crash(make_entries(3))
+        segment, = Spool(self.directory, fsync=False).pending()
+        with open(segment, "a") as segment_file:
+            segment_file.write("14411")
+
+        BufferedWriter(spool=Spool(self.directory, fsync=False)).recover()
+
+        self.assertEqual(EfergyData.objects.count(), 3)
+
+    def test_replay_is_idempotent(self):
+        entries = make_entries(5)
+        writer = BufferedWriter()
+        writer.extend(entries[:2])
+        writer.flush()
+        self.crash(entries)
+
+        BufferedWriter(spool=Spool(self.directory, fsync=False)).recover()
+
+        self.assertEqual(EfergyData.objects.count(), 5)
+
+    def test_keeps_segment_while_database_is_down(self):
+        spool = Spool(self.directory, fsync=False)
+        writer = BufferedWriter(batch_size=1000, spool=spool)
+        writer.extend(make_entries(4))
+        with mock.patch.object(
+                writer, "_write", side_effect=OperationalError("gone")):
+            self.assertEqual(writer.flush(), [])
+        self.assertEqual(len(spool.pending()), 1)
+
+        writer.flush()
+
+        self.assertEqual(EfergyData.objects.count(), 4)
+        self.assertEqual(spool.pending(), [])
+
+    def test_raises_without_spool(self):
+        writer = BufferedWriter(batch_size=1000)
+        writer.extend(make_entries(4))
+        with mock.patch.object(
+                writer, "_write", side_effect=OperationalError("gone")):
+            self.assertRaises(OperationalError, writer.flush)
+        self.assertEqual(len(writer), 4)
+
+        writer.flush()
+
+        self.assertEqual(EfergyData.objects.count(), 4)
+
+    def test_quarantines_refused_rows(self):
+        spool = Spool(self.directory, fsync=False)
+        writer = BufferedWriter(batch_size=1000, spool=spool)
+        entries = make_entries(4)
+        entries[2]["watts"] = POISON
+        writer.extend(entries)
+        with mock.patch.object(
+                writer, "_bulk_create", refuse_poison(writer._bulk_create)):
+            self.assertEqual(len(writer.flush()), 3)
+
+        self.assertEqual(EfergyData.objects.count(), 3)
+        self.assertEqual(writer.stats.rejected, 1)
+        self.assertEqual(spool.pending(), [])
+        quarantined = os.path.join(self.directory, spool.quarantine_name)
+        self.assertEqual(list(spool.read(quarantined)), [entries[2]])
+
+    def test_replay_quarantines_refused_rows(self):
+        entries = make_entries(4)
+        entries[0]["watts"] = POISON
+        self.crash(entries)
+
+        spool = Spool(self.directory, fsync=False)
+        writer = BufferedWriter(spool=spool)
+        with mock.patch.object(
+                writer, "_bulk_create", refuse_poison(writer._bulk_create)):
+            self.assertEqual(writer.recover()[0], 4)
+
+        self.assertEqual(EfergyData.objects.count(), 3)
+        self.assertEqual(spool.pending(), [])
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def get_rollup_timezone():
+    """
+    The timezone used to number the minutes of the day, which must match the
+    MySQL server's @@global.time_zone for both rollup paths to agree.
+    """
+    return pytz.timezone(
+        getattr(settings, "JOULE_TIMEZONE", "America/New_York"))
+
+
+def local_day_range(date, tz):
+    """
+    Returns the aware [start, end) of the local day «date» in «tz».
+    """
+    start = timezone.make_aware(datetime.combine(date, time.min), tz)
+    end = timezone.make_aware(
+        datetime.combine(date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def local_dates(start, end, tz):
+    """
+    Returns the list of local dates in «tz» touched by [start, end).
+    """
+    first = start.astimezone(tz).date()
+    last = (end - timedelta(microseconds=1)).astimezone(tz).date()
+    return [first + timedelta(days=offset)
+            for offset in range((last - first).days + 1)]
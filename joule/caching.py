@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Targeted cache invalidation with generation counters.
+
+Every cached value derived from a local day's (or a month's) data has the
+generation of that day (or month) in its key. Bumping the generation when
+the data changes makes the old entries unreachable, so they simply age out
+of the cache, and nothing else has to be cleared.
+
+A counter that isn't in the cache (because the cache was cleared, or it
+was never set) starts from the current time in milliseconds rather than
+from 0, so that it can't come back to a generation that was already used.
+
+Since an entry under a versioned key never changes, it can also be kept in
+the process for a while: «tiered_cache» checks a small in-process LRU
+before memcached. The counters themselves always come from memcached, so
+bumping a generation is seen by every process at once.
+
+Expensive values are computed with get_or_compute(), which makes sure only
+one process computes a given key at a time.
+"""
+
+from __future__ import unicode_literals
+
+import math
+import random
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import safe_cache_key
+
+
+def day_scope(date):
+    return "day:" + date.strftime("%Y-%m-%d")
+
+
+def month_scope(date):
+    return "month:" + date.strftime("%Y-%m")
+
+
+def date_scopes(dates):
+    """
+    Returns the day and month scopes of «dates».
+    """
+    scopes = set()
+    for date in dates:
+        scopes.add(day_scope(date))
+        scopes.add(month_scope(date))
+    return sorted(scopes)
+
+
+def generation_key(scope):
+    return safe_cache_key("joule:generation:" + scope)
+
+
+def initial_generation():
+    return int(time.time() * 1000)
+
+
+def get_generations(scopes):
+    """
+    Returns a dict of {scope: generation} for «scopes», with a single
+    get_many(), starting the counters that don't exist yet.
+    """
+    keys = dict((generation_key(scope), scope) for scope in scopes)
+    if not keys:
+        return dict()
+    found = cache.get_many(list(keys))
+    generations = dict()
+    for key, scope in keys.items():
+        if key not in found:
+            # Somebody else may be starting it at the same time
+            cache.add(key, initial_generation())
+            found[key] = cache.get(key)
+        generations[scope] = found[key]
+    return generations
+
+
+def get_generation(scope):
+    return get_generations([scope])[scope]
+
+
+def bump_generations(scopes):
+    """
+    Invalidates everything cached under «scopes».
+    """
+    for scope in scopes:
+        key = generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not in the cache, any new value is a new generation.
+            if not cache.add(key, initial_generation()):
+                cache.incr(key)
+
+
+def bump_dates(dates):
+    """
+    Invalidates everything cached for the local «dates» and their months.
+    """
+    bump_generations(date_scopes(dates))
+
+
+def versioned_key(key, scopes, generations=None):
+    """
+    Returns a cache key for «key» that includes the generations of
+    «scopes». Pass the dict of «generations» when making many keys, to look
+    them all up at once.
+    """
+    if generations is None:
+        generations = get_generations(scopes)
+    return safe_cache_key("{key}:g{generations}".format(
+        key=key, generations=".".join(
+            "{0}".format(generations[scope]) for scope in scopes)))
+
+
+class LRUCache(object):
+    """
+    A thread-safe, process-local cache of at most «max_size» entries, each
+    kept for at most «ttl» seconds, evicting the least recently used first.
+    """
+    def __init__(self, max_size=1000, ttl=300.0, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys):
+        now = self.clock()
+        found = dict()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is None or entry[0] <= now:
+                    self.misses += 1
+                    continue
+                # Re-inserting makes it the most recently used
+                self._entries[key] = entry
+                found[key] = entry[1]
+                self.hits += 1
+        return found
+
+    def set_many(self, data):
+        expires = self.clock() + self.ttl
+        with self._lock:
+            for key, value in data.items():
+                self._entries.pop(key, None)
+                self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TieredCache(object):
+    """
+    An LRUCache in front of the shared cache, for values that never change
+    under a given key (i.e. keys made with versioned_key()). Keeps hit and
+    miss counts for both tiers.
+    """
+    def __init__(self, local, shared=cache):
+        self.local = local
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = self.local.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = self.shared.get_many(missing)
+            self.shared_hits += len(shared)
+            self.shared_misses += len(missing) - len(shared)
+            if shared:
+                self.local.set_many(shared)
+                found.update(shared)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_shared(self, key, default=None):
+        """
+        Gets «key» from the shared cache only, e.g. because the local copy
+        is out of date, and keeps it locally.
+        """
+        value = self.shared.get(key)
+        if value is None:
+            self.shared_misses += 1
+            return default
+        self.shared_hits += 1
+        self.local.set_many({key: value})
+        return value
+
+    def set_many(self, data):
+        self.local.set_many(data)
+        self.shared.set_many(data)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def stats(self):
+        return {
+            "local_hits": self.local.hits,
+            "local_misses": self.local.misses,
+            "local_size": len(self.local),
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+        }
+
+    def report(self):
+        return ("local: {local_hits} hits, {local_misses} misses, "
+                "{local_size} entries; shared: {shared_hits} hits, "
+                "{shared_misses} misses".format(**self.stats()))
+
+
+tiered_cache = TieredCache(LRUCache(
+    max_size=getattr(settings, "JOULE_LOCAL_CACHE_SIZE", 2000),
+    ttl=getattr(settings, "JOULE_LOCAL_CACHE_TTL", 300.0)))
+
+
+def is_stale(entry, version, beta=1.0):
+    """
+    Returns True if the cached «entry» (value, version, delta, expires) is
+    of another «version», or should be recomputed because it expires soon.
+
+    The latter is decided by probabilistic early expiration ("XFetch"):
+    each reader recomputes ahead of «expires» with a probability that grows
+    as it nears, scaled by how long the value took to compute («delta»)
+    and «beta». Readers thus rarely all miss at the same moment.
+    """
+    value, entry_version, delta, expires = entry
+    if entry_version != version:
+        return True
+    if expires is None:
+        return False
+    # 1 - random() is in (0, 1], so its log is finite
+    return (time.time() - delta * beta * math.log(1.0 - random.random()) >=
+            expires)
+
+
+def get_or_compute(key, compute, version=None, ttl=None, store=None,
+                   lock_timeout=60, wait=10.0, poll=0.1, beta=1.0):
+    """
+    Returns the value cached under «key», or computes it with «compute»()
+    and caches it for «ttl» seconds (or, by default, until «version»
+    changes), such that only one process computes a key at a time:
+
+    - If a stale value is cached (see is_stale()), the first process to
+      notice takes a lock and recomputes it, while the others keep serving
+      the stale value.
+    - If nothing is cached, one process computes the value while the others
+      poll the cache for up to «wait» seconds before giving up and
+      computing it themselves.
+
+    The lock is a cache key added atomically, which expires after
+    «lock_timeout» seconds in case its holder dies. Values are cached in
+    «store», «tiered_cache» by default.
+    """
+    store = store or tiered_cache
+    key = safe_cache_key(key)
+    lock_key = safe_cache_key("joule:lock:" + key)
+
+    entry = store.get(key)
+    if entry is not None and is_stale(entry, version, beta) and \
+            hasattr(store, "get_shared"):
+        # Another process may have recomputed it already.
+        entry = store.get_shared(key, entry)
+    if entry is not None:
+        if not is_stale(entry, version, beta):
+            return entry[0]
+        if not cache.add(lock_key, 1, lock_timeout):
+            return entry[0]
+    else:
+        deadline = time.time() + wait
+        while not cache.add(lock_key, 1, lock_timeout):
+            if time.time() >= deadline:
+                return compute()
+            time.sleep(poll)
+            entry = store.get_shared(key) if hasattr(store, "get_shared") \
+                else store.get(key)
+            if entry is not None and entry[1] == version:
+                return entry[0]
+
+    try:
+        started = time.time()
+        value = compute()
+        delta = time.time() - started
+        expires = time.time() + ttl if ttl is not None else None
+        store.set(key, (value, version, delta, expires))
+        return value
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+
+from .piedmont import is_designated_holiday, is_summer
+from .tariffs import is_weekend
+from .utils import memoize_by_key_func
+
+
+WEEKEND = "weekend"
+SUMMER = "summer"
+WINTER = "winter"
+
+DAY_TYPES = (WEEKEND, SUMMER, WINTER)
+
+
+@memoize_by_key_func(key_func=lambda x: x.date() if hasattr(x, "date") else x)
+def get_day_type(day):
+    """
+    Returns the type of "tariff" day for the given date/datetime.
+    :param day: Can be of type «date» or «datetime»
+    :return: One of constants: {WEEKEND, SUMMER, WINTER}
+    """
+    if type(day) is not datetime:
+        day = datetime.combine(day, datetime.min.time())
+    if is_weekend(day) or is_designated_holiday(day):
+        return WEEKEND
+    elif is_summer(day):
+        return SUMMER
+    else:
+        return WINTER
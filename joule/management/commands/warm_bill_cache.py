@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import kronos
+
+from calendar import monthrange
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from joule.addons.efergy.models import DayData, MinuteData
+from joule.addons.efergy.profiles import get_profile_map
+from joule.addons.efergy.rollup import SummaryRollup
+from joule.utils import Timer
+from joule.views import BillEstimateView, get_day_summaries
+
+
+def get_recent_months(today, count):
+    """
+    Returns the (year, month) of the «count» months up to today's, latest
+    first.
+    """
+    year, month = today.year, today.month
+    months = []
+    for index in range(count):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months
+
+
+def summarize_missing_days(dates):
+    """
+    Rolls up the DayData of those «dates» that have minute data but no
+    DayData yet, so that the view doesn't have to summarise them on the fly.
+    Returns the number of days summarised.
+    """
+    summarised = set(DayData.objects.filter(date__in=dates).values_list(
+        'date', flat=True))
+    missing = [date for date in dates if date not in summarised]
+    if missing:
+        missing = sorted(set(MinuteData.objects.filter(
+            local_date__in=missing).values_list('local_date', flat=True)))
+    if missing:
+        SummaryRollup().update_days(missing)
+    return len(missing)
+
+
+def warm_month(year, month, now):
+    """
+    Warms what the bill view needs for «year», «month» as of «now»: the
+    summaries and profiles of its closed days and, for a closed month, its
+    context. The current month's context is left alone, as the minute rollup
+    invalidates it every minute anyway. Returns a list of (step, interval).
+    """
+    timings = []
+    try:
+        view = BillEstimateView()
+        view.now = now
+        view.today = now.date()
+        view.set_month(year, month)
+
+        # The current month's trend days before the 1st are the previous
+        # month's, and warmed with it.
+        first = view.active_month.date()
+        last = min(first.replace(day=monthrange(year, month)[1]),
+                   view.today - timedelta(days=1))
+        dates = [first + timedelta(days=offset)
+                 for offset in range((last - first).days + 1)]
+
+        with Timer() as timer:
+            summarize_missing_days(dates)
+            get_day_summaries(dates)
+        timings.append(("day summaries", timer.interval))
+
+        with Timer() as timer:
+            get_profile_map(dates)
+        timings.append(("day profiles", timer.interval))
+
+        if view.is_closed_month():
+            with Timer() as timer:
+                view.get_month_context()
+            timings.append(("month context", timer.interval))
+    finally:
+        # Each thread has its own connection, don't leave them dangling.
+        connection.close()
+    return timings
+
+
+@kronos.register("5 0 * * *")
+class Command(BaseCommand):
+
+    help = """Precomputes the day summaries and day profiles of the last
+    --months months (the current one included), and the bill contexts of the
+    closed ones, so that the first visitor of the day doesn't have to.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=2,
+            help='Number of months to warm, up to the current one.')
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Number of months to warm concurrently.')
+
+    def handle(self, *args, **options):
+        # The same local time as the view's, so the keys are the same too
+        now = timezone.now().astimezone(BillEstimateView().get_timezone())
+        months = get_recent_months(now.date(), options['months'])
+
+        pool = ThreadPool(min(options['workers'], len(months)))
+        with Timer() as timer:
+            try:
+                results = pool.map(
+                    lambda year_month: warm_month(
+                        year_month[0], year_month[1], now),
+                    months)
+            finally:
+                pool.close()
+                pool.join()
+
+        for (year, month), timings in zip(months, results):
+            for step, interval in timings:
+                print("{0}-{1:02d} {2}: {3}".format(
+                    year, month, step, interval))
+        print("{0}:: Warmed {1} months in {2}".format(
+            timezone.now(), len(months), timer.interval))
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('month', models.DateField(unique=True, verbose_name='month')),
+                ('context', models.BinaryField(verbose_name='context')),
+                ('tariff_version', models.CharField(max_length=32, verbose_name='tariff version', blank=True)),
+                ('computed_at', models.DateTimeField(verbose_name='computed at')),
+            ],
+            options={
+                'verbose_name': 'month snapshot',
+                'verbose_name_plural': 'month snapshots',
+            },
+        ),
+    ]
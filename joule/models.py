@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from django.utils.encoding import python_2_unicode_compatible
+
+from django.db import models
+from django.utils import timezone
+from django.utils.six.moves import cPickle as pickle
+from django.utils.translation import ugettext_lazy as _
+
+
+@python_2_unicode_compatible
+class MonthSnapshot(models.Model):
+    """
+    The computed context of BillEstimateView for a closed month, pickled, so
+    that the month can be rendered again from a single row. «month» is the
+    first day of the month, «tariff_version» the TARIFF_VERSION the context
+    was computed with.
+    """
+    month = models.DateField(_('month'), unique=True)
+    context = models.BinaryField(_('context'))
+    tariff_version = models.CharField(
+        _('tariff version'), max_length=32, blank=True)
+    computed_at = models.DateTimeField(_('computed at'))
+
+    class Meta:
+        verbose_name = _('month snapshot')
+        verbose_name_plural = _('month snapshots')
+
+    @classmethod
+    def load(cls, month, tariff_version):
+        """
+        Returns the stored context of «month», or None if there is none for
+        «tariff_version».
+        """
+        context = cls.objects.filter(
+            month=month, tariff_version=tariff_version,
+        ).values_list('context', flat=True).first()
+        if context is None:
+            return None
+        return pickle.loads(bytes(context))
+
+    @classmethod
+    def store(cls, month, context, tariff_version):
+        cls.objects.update_or_create(month=month, defaults={
+            'context': pickle.dumps(context, pickle.HIGHEST_PROTOCOL),
+            'tariff_version': tariff_version,
+            'computed_at': timezone.now(),
+        })
+
+    @classmethod
+    def invalidate(cls, dates):
+        """
+        Deletes the snapshots of the months containing any of «dates».
+        """
+        months = set(date.replace(day=1) for date in dates)
+        if months:
+            cls.objects.filter(month__in=months).delete()
+
+    def __str__(self):
+        return "Snapshot of {month:%B %Y}".format(month=self.month)
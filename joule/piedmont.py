@@ -131,6 +131,10 @@ def is_winter_peak_hour(timestamp):
     )
 
 
+# Identifies the tariff and bill below in the bill API's ETags, the cached
+# month contexts and the MonthSnapshots, so change it whenever they change.
+TARIFF_VERSION = "2015.1"
+
 # Creates the Piedmont Time of Day Energy Only Tariff
 piedmont_tariff = Tariff(modifiers=[
     RateModifier(always, 0.0499),
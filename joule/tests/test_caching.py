@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from ..caching import LRUCache, TieredCache, get_or_compute, is_stale
+from ..utils import safe_cache_key
+
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+KEY = "joule:tests:value"
+
+
+def lock_key(key):
+    return safe_cache_key("joule:lock:" + safe_cache_key(key))
+
+
+class Counter(object):
+    """
+    A compute() that counts its calls.
+    """
+    def __init__(self, value="fresh"):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetOrComputeTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.store = TieredCache(LRUCache(), shared=cache)
+
+    def get(self, compute, **kwargs):
+        kwargs.setdefault("store", self.store)
+        return get_or_compute(KEY, compute, **kwargs)
+
+    def cached(self, value, version=1, delta=0.0, expires=None):
+        self.store.set(safe_cache_key(KEY), (value, version, delta, expires))
+
+    def test_computes_once(self):
+        compute = Counter()
+        self.assertEqual(self.get(compute, version=1), "fresh")
+        self.assertEqual(self.get(compute, version=1), "fresh")
+        self.assertEqual(compute.calls, 1)
+        self.assertIsNone(cache.get(lock_key(KEY)))
+
+    def test_recomputes_new_version(self):
+        self.cached("old", version=1)
+        compute = Counter()
+        self.assertEqual(self.get(compute, version=2), "fresh")
+        self.assertEqual(self.get(compute, version=2), "fresh")
+        self.assertEqual(compute.calls, 1)
+
+    def test_recomputes_after_ttl(self):
+        self.cached("old", expires=time.time() - 1)
+        compute = Counter()
+        self.assertEqual(self.get(compute, version=1, ttl=60), "fresh")
+        self.assertEqual(compute.calls, 1)
+
+    def test_serves_stale_value_while_locked(self):
+        self.cached("old", version=1)
+        cache.add(lock_key(KEY), 1)
+        compute = Counter()
+        self.assertEqual(self.get(compute, version=2), "old")
+        self.assertEqual(compute.calls, 0)
+
+    def test_waits_for_lock_holder(self):
+        cache.add(lock_key(KEY), 1)
+
+        def holder():
+            time.sleep(0.1)
+            self.cached("theirs", version=1)
+            cache.delete(lock_key(KEY))
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        compute = Counter()
+        try:
+            value = self.get(compute, version=1, wait=5.0, poll=0.01)
+        finally:
+            thread.join()
+        self.assertEqual(value, "theirs")
+        self.assertEqual(compute.calls, 0)
+
+    def test_computes_after_waiting_in_vain(self):
+        cache.add(lock_key(KEY), 1)
+        compute = Counter()
+        self.assertEqual(
+            self.get(compute, version=1, wait=0.05, poll=0.01), "fresh")
+        self.assertEqual(compute.calls, 1)
+
+    def test_releases_lock_on_error(self):
+        def compute():
+            raise ValueError("broken")
+
+        self.assertRaises(ValueError, self.get, compute, version=1)
+        self.assertIsNone(cache.get(lock_key(KEY)))
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "fresh"
+
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(self.get(slow, version=1)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(
+            self.get(slow, version=1, wait=5.0, poll=0.01)))
+        second.start()
+        time.sleep(0.05)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(results, ["fresh", "fresh"])
+        self.assertEqual(len(calls), 1)
+
+
+class IsStaleTests(SimpleTestCase):
+
+    def test_other_version(self):
+        self.assertTrue(is_stale(("value", 1, 0.0, None), 2))
+
+    def test_no_expiry(self):
+        self.assertFalse(is_stale(("value", 1, 100.0, None), 1))
+
+    def test_expired(self):
+        self.assertTrue(is_stale(("value", 1, 0.0, time.time() - 1), 1))
+
+    def test_far_from_expiry(self):
+        self.assertFalse(is_stale(("value", 1, 0.001, time.time() + 3600), 1))
+
+    def test_early_expiry_grows_with_delta(self):
+        expires = time.time() + 1
+        slow = sum(is_stale(("value", 1, 10.0, expires), 1)
+                   for attempt in range(200))
+        fast = sum(is_stale(("value", 1, 0.001, expires), 1)
+                   for attempt in range(200))
+        self.assertGreater(slow, 100)
+        self.assertEqual(fast, 0)
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(max_size=2)
+        lru.set_many({"a": 1, "b": 2})
+        lru.get_many(["a"])
+        lru.set_many({"c": 3})
+        self.assertEqual(lru.get_many(["a", "b", "c"]), {"a": 1, "c": 3})
+
+    def test_expires(self):
+        now = [100.0]
+        lru = LRUCache(ttl=10, clock=lambda: now[0])
+        lru.set_many({"a": 1})
+        now[0] += 11
+        self.assertEqual(lru.get_many(["a"]), {})
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytz
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+
+from joule.addons.efergy.models import MinuteData
+from joule.addons.wunderground.models import WeatherData
+
+from ..views import load_day_summaries
+
+
+TZ = pytz.timezone("America/New_York")
+
+
+def weather(day, hour, temp):
+    WeatherData.objects.create(
+        timestamp=TZ.localize(datetime.combine(day, datetime.min.time()) +
+                              timedelta(hours=hour)),
+        outside_temp=Decimal(temp), outside_humidity=Decimal(50),
+        barometric_pressure=Decimal(1000))
+
+
+@override_settings(JOULE_TIMEZONE="America/New_York")
+class LoadDaySummariesTests(TestCase):
+
+    def test_summarizes_minutes_and_temperatures(self):
+        day = date(2015, 9, 1)
+        MinuteData.objects.create(
+            timestamp=TZ.localize(datetime(2015, 9, 1, 12)), minute=720,
+            watts=Decimal(60000), local_date=day)
+        weather(day, 6, "61.5")
+        weather(day, 15, "80.25")
+
+        self.assertEqual(load_day_summaries([day])[day], {
+            "energy": Decimal(1), "high": Decimal("80.25"),
+            "low": Decimal("61.5")})
+
+    def test_temperatures_without_minutes(self):
+        day = date(2015, 9, 2)
+        weather(day, 23, "70")
+        # The next local day
+        weather(day, 24, "90")
+
+        self.assertEqual(load_day_summaries([day, day + timedelta(days=1)]), {
+            day: {"energy": None, "high": Decimal(70), "low": Decimal(70)},
+            day + timedelta(days=1): {
+                "energy": None, "high": Decimal(90), "low": Decimal(90)},
+        })
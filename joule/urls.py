@@ -8,7 +8,7 @@ from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.contrib import admin
 from django.conf import settings
 
-from .views import BillEstimateView
+from .views import BillEstimateView, bill_json_view, export_view
 
 admin.autodiscover()
 
@@ -18,8 +18,12 @@ urlpatterns = i18n_patterns('',
 
     url(r'^bill/(?P<year>\d{4})/(?P<month>\d{1,2})/$',
         BillEstimateView.as_view(), name='bill_view'),
+    url(r'^bill/(?P<year>\d{4})/(?P<month>\d{1,2})/json/$',
+        bill_json_view, name='bill_json'),
     url(r'^bill/(?P<year>\d{4})/$',
         BillEstimateView.as_view(), name='bill_view'),
+    url(r'^export/(?P<kind>raw|minute)\.(?P<format>csv|ndjson)$',
+        export_view, name='export_data'),
     url(r'^bill/$',
         BillEstimateView.as_view(), name='bill_view'),
     url(r'^/?$',
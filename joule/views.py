@@ -2,6 +2,8 @@
 
 from __future__ import unicode_literals, division
 
+import hashlib
+import json
 import pytz
 
 from calendar import monthrange
@@ -10,62 +12,139 @@ from decimal import Decimal
 from functools import partial
 from tzlocal import get_localzone
 
-from django.db.models import Max, Min, Sum
 from django.conf import settings
-from django.core.cache import cache
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
-from django.db import connection
+from django.db.models import Sum
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    StreamingHttpResponse,
+)
 from django.shortcuts import redirect
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
 
-from .piedmont import (
-    is_designated_holiday,
-    is_summer,
-    piedmont_bill,
-    piedmont_tariff,
-)
+from .daytypes import WEEKEND, SUMMER, WINTER, get_day_type
+from .piedmont import TARIFF_VERSION, piedmont_bill, piedmont_tariff
 
-from addons.efergy.models import MinuteData
-from addons.efergy.management.commands.data_coverage import get_minute_coverage
+from addons.efergy.export import CONTENT_TYPES, iter_export
+from addons.efergy.models import DayData, MinuteData
+from addons.efergy.management.commands.data_coverage import get_cached_coverage
+from addons.efergy.profiles import grouped_hourly_watt_minutes
+from addons.efergy.rollup import WATTS_PRECISION
+from addons.efergy.utils import get_rollup_timezone, local_day_range
 from addons.wunderground.models import WeatherData
-from .utils import safe_cache_key
-from .tariffs import is_weekend
+from .caching import (
+    day_scope,
+    get_generation,
+    get_generations,
+    get_or_compute,
+    month_scope,
+    tiered_cache,
+    versioned_key,
+)
+from .models import MonthSnapshot
 
 
-WEEKEND = "weekend"
-SUMMER = "summer"
-WINTER = "winter"
+# Seconds for which the current month's context is reused.
+MONTH_CONTEXT_TTL = 60
 
 ZERO = Decimal(0.0)
+NO_SUMMARY = {"energy": None, "high": None, "low": None}
 
 
-def get_day_data(day, use_cache=True):
-    """Given a single day, return summary data, but in a cached manner."""
-    cache_key = safe_cache_key("joule:views:get_day_cache:" + str(day.date()))
-    data = None
-    if use_cache:
-        data = cache.get(cache_key, None)
-    if not data:
-        temps = WeatherData.objects.filter(
-            timestamp__range=(day, day + timedelta(days=1, seconds=-1))
-        ).aggregate(high=Max('outside_temp'), low=Min('outside_temp'))
-        summary = MinuteData.objects.filter(
-            timestamp__range=(day, day + timedelta(days=1, seconds=-1))
-        ).aggregate(watts=Sum('watts'))
-
-        kwhrs = Decimal(summary["watts"]) / Decimal(60000.0) if summary["watts"] else ZERO
-        data = {
-            "date": day,
-            "kwhrs": kwhrs,
-            "high": temps["high"],
-            "low": temps["low"],
-            "high_pct": (Decimal(temps["high"]) / Decimal(1.2) if temps["high"] else ZERO),
-            "low_pct": Decimal(temps["low"]) / Decimal(1.2) if temps["low"] else ZERO,
-        }
-        if use_cache:
-            cache.set(cache_key, data)
-    return data
+def load_day_summaries(dates):
+    """
+    Returns a dict of {date: (energy, high, low) dict} for «dates»: one
+    DayData query, then, for the days that haven't been rolled up yet, one
+    grouped MinuteData query and one WeatherData query bucketed by local
+    date.
+    """
+    summaries = dict(
+        (row["date"], row) for row in DayData.objects.filter(
+            date__in=dates).values("date", "energy", "high", "low"))
+    missing = [date for date in dates if date not in summaries]
+    if missing:
+        summaries.update(summarize_days(missing))
+    return summaries
+
+
+def summarize_days(dates):
+    """
+    Returns a dict of {date: (energy, high, low) dict} for every one of
+    «dates», computed from MinuteData and WeatherData like SummaryRollup
+    does. «energy» is None for the days without MinuteData, and «high» and
+    «low» for those without WeatherData.
+    """
+    totals = dict(MinuteData.objects.filter(local_date__in=dates).values(
+        "local_date").annotate(total=Sum("watts")).order_by().values_list(
+        "local_date", "total"))
+    summaries = dict(
+        (date, {
+            "energy": ((totals[date] / 60000).quantize(WATTS_PRECISION)
+                       if date in totals else None),
+            "high": None,
+            "low": None,
+        }) for date in dates)
+
+    tz = get_rollup_timezone()
+    temps = WeatherData.objects.filter(
+        timestamp__gte=local_day_range(min(dates), tz)[0],
+        timestamp__lt=local_day_range(max(dates), tz)[1],
+    ).values_list("timestamp", "outside_temp")
+    for timestamp, temp in temps.iterator():
+        summary = summaries.get(timestamp.astimezone(tz).date())
+        if summary is None:
+            continue
+        if summary["high"] is None or temp > summary["high"]:
+            summary["high"] = temp
+        if summary["low"] is None or temp < summary["low"]:
+            summary["low"] = temp
+    return summaries
+
+
+def get_day_summaries(dates):
+    """
+    Like load_day_summaries(), but each day's summary is cached on its own
+    until the day's data changes, so any range of days is assembled from
+    one get_many() and only the days missing from the cache are loaded.
+    """
+    generations = get_generations([day_scope(date) for date in dates])
+    keys = dict(
+        (versioned_key("joule:views:day_summary:" + date.isoformat(),
+                       [day_scope(date)], generations), date)
+        for date in dates)
+    summaries = dict(
+        (keys[key], summary)
+        for key, summary in tiered_cache.get_many(keys).items())
+    missing = [date for date in dates if date not in summaries]
+    if missing:
+        loaded = load_day_summaries(missing)
+        tiered_cache.set_many(dict(
+            (key, loaded[date]) for key, date in keys.items()
+            if date in loaded))
+        summaries.update(loaded)
+    return summaries
+
+
+def make_day_data(day, summary):
+    """
+    Returns the template's dict for «day» from its (energy, high, low)
+    «summary».
+    """
+    kwhrs = Decimal(summary["energy"]) if summary["energy"] else ZERO
+    return {
+        "date": day,
+        "kwhrs": kwhrs,
+        "high": summary["high"],
+        "low": summary["low"],
+        "high_pct": (Decimal(summary["high"]) / Decimal(1.2) if summary["high"] else ZERO),
+        "low_pct": Decimal(summary["low"]) / Decimal(1.2) if summary["low"] else ZERO,
+    }
 
 
 def get_daily_data(start_day, end_day=None, today=None):
@@ -84,12 +163,17 @@ def get_daily_data(start_day, end_day=None, today=None):
 
     today = timezone.now().date()
 
+    days = [start_day + timedelta(days=day_no)
+            for day_no in range(0, num_days+1)]
+    summaries = get_day_summaries(
+        [day.date() for day in days if day.date() <= today])
+
     day_list = []
     max_kwhrs = Decimal(0.0)
-    for day_no in range(0, num_days+1):
-        day = start_day + timedelta(days=day_no)
+    for day in days:
         if day.date() <= today:
-            data = get_day_data(day, use_cache=(day.date() < today))
+            data = make_day_data(
+                day, summaries.get(day.date(), NO_SUMMARY))
         else:
             data = {
                 "date": day, "kwhrs": ZERO, "high": ZERO, "low": ZERO,
@@ -107,22 +191,6 @@ def get_daily_data(start_day, end_day=None, today=None):
     return day_list
 
 
-def get_day_type(day):
-    """
-    Returns the type of "tariff" day for the given date/datetime.
-    :param day: Can be of type «date» or «datetime»
-    :return: One of constants: {WEEKEND, SUMMER, WINTER}
-    """
-    if type(day) is not datetime:
-        day = datetime.combine(day, datetime.min.time())
-    if is_weekend(day) or is_designated_holiday(day):
-        return WEEKEND
-    elif is_summer(day):
-        return SUMMER
-    else:
-        return WINTER
-
-
 def categorize_days(start_day, end_day=None):
     """
     Separates the days provided in the range «start_day» to «end_day»
@@ -163,47 +231,30 @@ def categorize_days(start_day, end_day=None):
     return all_days
 
 
-def get_aggregate_minute_data(days):
+def get_grouped_minute_data(days_dict):
     """
-    Gets aggregate minute data for the days provided. Uses Memcache to
-    cache results.
+    Like get_aggregate_minute_data(), but for a dict of {key: list of days}.
+    Returns a dict of {key: wm_hours}. The profile of each closed day is
+    cached on its own, so nothing needs caching here.
     """
-    empty_hours = [0] * 24
-    if days:
-        days_str = ",".join([day.strftime("\"%Y-%m-%d\"") for day in days])
-        cache_key = safe_cache_key(
-            "joule:views:get_aggregate_minute_data:" + days_str)
-        today = datetime.combine(datetime.today(), datetime.min.time())
-        if today in days:
-            wm_hours = None
-        else:
-            wm_hours = cache.get(cache_key, None)
-        if not wm_hours:
-            # Initialize a list of 24 zeros
-            wm_hours = empty_hours
-            cursor = connection.cursor()
-            query = """
-                SELECT `minute`, AVG(`watts`) FROM `efergy_minutedata`
-                WHERE DATE(CONVERT_TZ(`timestamp`, '+00:00', '-04:00')) in (%s)
-                GROUP BY `minute`
-                ORDER BY `minute`
-            """ % (days_str, )
-            cursor.execute(query)
-
-            # Add the minute's average consumption (watt-minutes) to the
-            # respective hour
-            for minute_row in cursor.fetchall():
-                hour = minute_row[0] // 60
-                wm_hours[hour] = float(wm_hours[hour]) + float(minute_row[1])
+    return grouped_hourly_watt_minutes(dict(
+        (key, [day.date() for day in days])
+        for key, days in days_dict.items()))
 
-            cache.set(cache_key, wm_hours)
 
-        return wm_hours
+def get_aggregate_minute_data(days):
+    """
+    Gets aggregate minute data for the days provided. The profile of each
+    closed day is cached on its own, so any set of days is assembled from
+    one get_many().
 
-    return empty_hours
+    For each hour of the day, this is the sum over the hour's minutes of the
+    minute's average consumption across «days», in watt-minutes.
+    """
+    return get_grouped_minute_data({None: days})[None]
 
 
-def get_hours(days_dict, tariff, day_counts=None):
+def get_hours(days_dict, tariff, day_counts=None, wm_hours_dict=None):
     """
     Given a dict of tariff-types and their list of days, return a list of
     tuples, one for each hour [0..23] of the day containing:
@@ -213,13 +264,18 @@ def get_hours(days_dict, tariff, day_counts=None):
     :param day_counts: A dict containing { tariff-type: num_past_days }, if
                        present is used instead of num of days taken from
                        days_dict.
+    :param wm_hours_dict: A dict containing { tariff-type: wm_hours }, if
+                          present is used instead of looking the aggregate
+                          minute data of days_dict up.
     :return: a dict containing tariff-types and respective dict of:
              {hour, kwhrs, cost, ext_cost} for each hour.
     """
     all_hours_dict = dict()
+    if wm_hours_dict is None:
+        wm_hours_dict = get_grouped_minute_data(days_dict)
 
     for tariff_type, days in days_dict.items():
-        wm_hours = get_aggregate_minute_data(days)
+        wm_hours = wm_hours_dict[tariff_type]
 
         # Convert from Wm to kWHrs, and to a tuple
         hours = list()
@@ -288,7 +344,7 @@ def get_merged_hours(a, b, a_weight=1, b_weight=1):
         merge = partial(get_weighted_merge,
                         a_weight=a_weight[tariff_type],
                         b_weight=b_weight[tariff_type])
-        hours[tariff_type] = map(merge, a[tariff_type], b[tariff_type])
+        hours[tariff_type] = list(map(merge, a[tariff_type], b[tariff_type]))
     return hours
 
 
@@ -323,6 +379,46 @@ class BillEstimateView(TemplateView):
                 getattr(settings, "JOULE_TIMEZONE", "America/New_York"))
         return self.tz
 
+    def is_current_month(self):
+        active_month_end = self.active_month.replace(
+            day=monthrange(self.year, self.month)[1])
+        return self.active_month.date() < self.today <= active_month_end.date()
+
+    def is_closed_month(self):
+        """
+        Returns True if the active month ended before today.
+        """
+        return self.active_month.date() < self.today.replace(day=1)
+
+    def get_month_context(self):
+        """
+        Returns compute_month_context(), cached until the month's data or
+        TARIFF_VERSION changes (or, for the current month, for
+        MONTH_CONTEXT_TTL seconds) and computed by one process at a time. A
+        closed month comes from its snapshot, which is stored if there isn't
+        one for TARIFF_VERSION yet.
+        """
+        month = self.active_month.date()
+        version = get_generation(month_scope(month))
+        if not self.is_closed_month():
+            return get_or_compute(
+                "joule:views:month_context:{0}:{1:%Y-%m}:{2}".format(
+                    TARIFF_VERSION, month, self.today),
+                self.compute_month_context, version=version,
+                ttl=MONTH_CONTEXT_TTL)
+        return get_or_compute(
+            "joule:views:month_context:{0}:{1:%Y-%m}".format(
+                TARIFF_VERSION, month),
+            self.get_month_snapshot, version=version)
+
+    def get_month_snapshot(self):
+        month = self.active_month.date()
+        context = MonthSnapshot.load(month, TARIFF_VERSION)
+        if context is None:
+            context = self.compute_month_context()
+            MonthSnapshot.store(month, context, TARIFF_VERSION)
+        return context
+
     def get(self, request, *args, **kwargs):
         self.now = timezone.now().astimezone(self.get_timezone())
         self.today = self.now.date()
@@ -336,6 +432,16 @@ class BillEstimateView(TemplateView):
                 "year": self.today.year, "month": self.today.month})
             return redirect(to=url)
 
+        self.set_month(self.year, self.month)
+
+        return super(BillEstimateView, self).get(request, *args, **kwargs)
+
+    def set_month(self, year, month):
+        """
+        Makes «year», «month» the active month, as seen from self.today.
+        """
+        self.year = year
+        self.month = month
         self.active_month = datetime(self.year, self.month, 1)
 
         if self.today.year == self.year and self.today.month == self.month:
@@ -349,11 +455,50 @@ class BillEstimateView(TemplateView):
             # rest of the month is another.
             self.num_trend_days = 7
 
-        return super(BillEstimateView, self).get(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
-
         context = super(BillEstimateView, self).get_context_data(**kwargs)
+        context.update(self.get_month_context())
+
+        active_month_end = self.active_month.replace(
+            day=monthrange(self.year, self.month)[1])
+
+        self.current_month = self.is_current_month()
+        context["current_month"] = self.current_month
+        context["today"] = self.today
+        context['now'] = self.now
+
+        first_month = self.get_first_month()
+
+        prev_month_end = self.active_month - timedelta(days=1)
+        prev_month = prev_month_end.replace(day=1)
+        if prev_month >= first_month:
+            context['prev_month'] = prev_month
+
+        if (self.now.year != self.active_month.year or
+                    self.now.month != self.active_month.month):
+            context['next_month'] = active_month_end + timedelta(days=1)
+
+        context['timer'] = datetime.now() - self.start_time
+        if self.request.user.is_staff:
+            context['cache_stats'] = tiered_cache.report()
+
+        if self.current_month:
+            # Kept up to date by the rollup_minute_data job, never computed
+            # here.
+            coverage = get_cached_coverage()
+            if coverage is not None:
+                context['stats'] = coverage["coverage"]
+                context['stats_computed_at'] = coverage["computed_at"]
+                context['latest_minute'] = coverage["latest_minute"]
+
+        return context
+
+    def compute_month_context(self):
+        """
+        Computes the part of the context that only depends on the active
+        month's data (and, for the current month, on today).
+        """
+        context = dict()
         month_end = self.active_month.replace(
             day=monthrange(self.active_month.year, self.active_month.month)[1])
         active_month_end = self.active_month.replace(
@@ -373,11 +518,6 @@ class BillEstimateView(TemplateView):
             past_days = categorize_days(self.active_month, active_month_end)
             future_days = []
 
-        self.current_month = (
-            self.active_month.date() < self.today <= active_month_end.date())
-        context["current_month"] = self.current_month
-        context["today"] = self.today
-
         today_type = get_day_type(self.today)
 
         # How many days of each type?
@@ -406,21 +546,37 @@ class BillEstimateView(TemplateView):
 
         total_days = sum([num_days[WEEKEND], num_days[SUMMER], num_days[WINTER]])
 
-        past_hours = get_hours(past_days, piedmont_tariff)
+        # Look the aggregate minute data of the past and trend days up at once
+        # ----------------------------------------------------------------------
+        groups = dict(
+            (("past", tariff_type), days)
+            for tariff_type, days in past_days.items())
+        if self.num_trend_days:
+            trend_days = categorize_days(
+                self.today - timedelta(days=self.num_trend_days), self.today)
+            groups.update(
+                (("trend", tariff_type), days)
+                for tariff_type, days in trend_days.items())
+        wm_hours = get_grouped_minute_data(groups)
+
+        past_hours = get_hours(past_days, piedmont_tariff, wm_hours_dict=dict(
+            (tariff_type, wm_hours[("past", tariff_type)])
+            for tariff_type in past_days))
 
         # If we'll be using trend days to project the rest of the month, then
         # prepare the trend hours and blend with the past hours.
         # ----------------------------------------------------------------------
         if self.num_trend_days:
-            trend_days = categorize_days(
-                self.today - timedelta(days=self.num_trend_days), self.today)
             future_days_count = {
                 WEEKEND: len(future_days[WEEKEND]),
                 SUMMER: len(future_days[SUMMER]),
                 WINTER: len(future_days[WINTER]),
             }
             trend_hours = get_hours(
-                trend_days, piedmont_tariff, future_days_count)
+                trend_days, piedmont_tariff, future_days_count,
+                wm_hours_dict=dict(
+                    (tariff_type, wm_hours[("trend", tariff_type)])
+                    for tariff_type in trend_days))
 
             hours = get_merged_hours(
                 past_hours, trend_hours, num_past_days, num_future_days)
@@ -524,32 +680,116 @@ class BillEstimateView(TemplateView):
         context['est_kwhrs'] = est_kwhrs
         context['est_energy_cost'] = est_energy_cost
 
-        piedmont_bill.initialize(est_kwhrs, est_energy_cost, total_days)
-        context['est_bill'] = piedmont_bill.get_total()
+        # piedmont_bill is shared, e.g. by warm_bill_cache's threads, so it
+        # mustn't be initialize()d here.
+        context['est_bill'] = piedmont_bill.get_total(
+            est_energy_cost, est_kwhrs, total_days)
 
         context['hours'] = range(0, 24)
 
         context['active_month'] = (self.active_month, active_month_end)
 
-        context['now'] = self.now
-
         context["temperatures"] = get_daily_data(
             self.active_month, month_end, self.today)
 
-        first_month = self.get_first_month()
+        return context
 
-        prev_month_end = self.active_month - timedelta(days=1)
-        prev_month = prev_month_end.replace(day=1)
-        if prev_month >= first_month:
-            context['prev_month'] = prev_month
 
-        if (self.now.year != self.active_month.year or
-                    self.now.month != self.active_month.month):
-            context['next_month'] = active_month_end + timedelta(days=1)
+def get_bill_last_modified(request, year, month):
+    """
+    Returns the timestamp of the latest MinuteData up to the end of the
+    month, which is when the month's estimate last changed.
+    """
+    if not hasattr(request, "_bill_last_modified"):
+        year, month = int(year), int(month)
+        month_end = local_day_range(
+            datetime(year, month, monthrange(year, month)[1]).date(),
+            get_rollup_timezone())[1]
+        request._bill_last_modified = MinuteData.objects.filter(
+            timestamp__lt=month_end).order_by("-timestamp").values_list(
+            "timestamp", flat=True).first()
+    return request._bill_last_modified
+
+
+def get_bill_etag(request, year, month):
+    last_modified = get_bill_last_modified(request, year, month)
+    if last_modified is None:
+        return None
+    generation = get_generation(
+        month_scope(datetime(int(year), int(month), 1)))
+    value = "{year}-{month}:{generation}:{tariff}:{timestamp}".format(
+        year=year, month=month, generation=generation,
+        tariff=TARIFF_VERSION, timestamp=last_modified.isoformat())
+    return hashlib.md5(value.encode("utf-8")).hexdigest()
+
+
+class BillEstimateJSONView(BillEstimateView):
+    """
+    The bill estimate of a month as JSON, for pollers. Served through
+    bill_json_view, which answers 304 Not Modified until new minute data
+    arrives for the month (or TARIFF_VERSION changes).
+    """
+    context_keys = (
+        "active_month", "current_month", "today", "now",
+        "num_days", "num_past_days",
+        "weekend_hours", "summer_hours", "winter_hours",
+        "kwhrs_per_weekend", "kwhrs_per_summer", "kwhrs_per_winter",
+        "cost_per_weekend", "cost_per_summer", "cost_per_winter",
+        "ext_cost_per_weekend", "ext_cost_per_summer", "ext_cost_per_winter",
+        "est_kwhrs", "est_energy_cost", "est_bill",
+        "temperatures",
+    )
 
-        context['timer'] = datetime.now() - self.start_time
+    def get_context_data(self, **kwargs):
+        context = dict(self.get_month_context())
+        context["current_month"] = self.is_current_month()
+        context["today"] = self.today
+        context["now"] = self.now
+        return context
 
-        if self.current_month:
-            context['stats'] = get_minute_coverage()
+    def render_to_response(self, context, **response_kwargs):
+        data = dict((key, context[key]) for key in self.context_keys)
+        return HttpResponse(
+            json.dumps(data, cls=DjangoJSONEncoder),
+            content_type="application/json", **response_kwargs)
 
-        return context
+
+bill_json_view = condition(
+    etag_func=get_bill_etag,
+    last_modified_func=get_bill_last_modified,
+)(BillEstimateJSONView.as_view())
+
+
+@staff_member_required
+def export_view(request, kind, format):
+    """
+    Streams the «kind» (raw or minute) data of the local dates ?from= to
+    ?to= (YYYY-MM-DD, inclusive, «to» defaults to «from») as «format» (csv
+    or ndjson), gzipped if ?gzip=1.
+    """
+    try:
+        first = parse_date(request.GET.get("from", ""))
+        last = parse_date(request.GET.get("to", "")) or first
+    except ValueError:
+        first = None
+    if first is None or last < first:
+        return HttpResponseBadRequest(
+            "Expected ?from=YYYY-MM-DD[&to=YYYY-MM-DD]")
+
+    tz = get_rollup_timezone()
+    compress = request.GET.get("gzip") == "1"
+    file_name = "efergy-{kind}-{first}-{last}.{format}".format(
+        kind=kind, first=first, last=last, format=format)
+    if compress:
+        content_type = "application/gzip"
+        file_name += ".gz"
+    else:
+        content_type = CONTENT_TYPES[format]
+
+    response = StreamingHttpResponse(
+        iter_export(kind, local_day_range(first, tz)[0],
+                    local_day_range(last, tz)[1], format, compress),
+        content_type=content_type)
+    response["Content-Disposition"] = 'attachment; filename="{0}"'.format(
+        file_name)
+    return response